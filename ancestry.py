@@ -0,0 +1,152 @@
+from bisect import bisect_right
+
+import numpy as np
+
+
+class AncestorIndex:
+    """
+    Индекс предков для готового дерева: узлы нумеруются целыми id в порядке
+    обхода в глубину, по эйлерову обходу строится разреженная таблица минимумов.
+    Наименьший общий предок (LCA) - O(1), k-й предок - O(log n) (двоичный поиск
+    по узлам одной глубины), операции от корня до узла - проход по массиву
+    родителей без обращений к self.nodes.
+
+    Глубина здесь - число ребер от корня. Индекс строится один раз и после
+    изменения дерева устаревает: его нужно построить заново.
+    """
+
+    def __init__(self, tree):
+        self.root = tree.root
+        self.keys = []
+        self.ids = {}
+        parent = []
+        depth = []
+        self._ops = []
+        euler = []
+        self._first = []
+        self._last = []
+
+        stack = [(tree.root, -1, None)]
+        while stack:
+            node, parent_id, op = stack.pop()
+            if node is None:
+                # Поддерево узла parent_id обойдено: возвращаемся в его родителя
+                self._last[parent_id] = len(euler) - 1
+                if parent[parent_id] >= 0:
+                    euler.append(parent[parent_id])
+                continue
+            node_id = len(self.keys)
+            self.ids[node] = node_id
+            self.keys.append(node)
+            parent.append(parent_id)
+            depth.append(0 if parent_id < 0 else depth[parent_id] + 1)
+            self._ops.append(op)
+            self._first.append(len(euler))
+            self._last.append(len(euler))
+            euler.append(node_id)
+            stack.append((None, node_id, None))
+            for child in reversed(tree.nodes[node]["children"]):
+                stack.append((child["node"], node_id, child["op"]))
+
+        self._parent = parent
+        self.parent = np.array(parent, dtype=np.int64)
+        self.depth = np.array(depth, dtype=np.int64)
+        self._first = np.array(self._first, dtype=np.int64)
+        self._last = np.array(self._last, dtype=np.int64)
+
+        # Узлы каждой глубины в порядке обхода (их номера возрастают)
+        self._levels = []
+        for node_id, node_depth in enumerate(depth):
+            if node_depth == len(self._levels):
+                self._levels.append([])
+            self._levels[node_depth].append(node_id)
+
+        # table[k][i] - узел наименьшей глубины среди euler[i:i + 2**k]
+        self._table = [np.array(euler, dtype=np.int64)]
+        span = 1
+        while 2 * span <= len(euler):
+            previous = self._table[-1]
+            left, right = previous[:-span], previous[span:]
+            self._table.append(np.where(self.depth[left] <= self.depth[right], left, right))
+            span *= 2
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _lca_id(self, u, v):
+        left, right = self._first[u], self._first[v]
+        if left > right:
+            left, right = right, left
+        level = int(right - left + 1).bit_length() - 1
+        table = self._table[level]
+        a, b = table[left], table[right - (1 << level) + 1]
+        return int(a if self.depth[a] <= self.depth[b] else b)
+
+    def lca(self, u, v):
+        """Наименьший общий предок узлов u и v"""
+        return self.keys[self._lca_id(self.ids[u], self.ids[v])]
+
+    def distance(self, u, v):
+        """Количество ребер (операций) на пути между u и v"""
+        u, v = self.ids[u], self.ids[v]
+        return int(self.depth[u] + self.depth[v] - 2 * self.depth[self._lca_id(u, v)])
+
+    def is_ancestor(self, ancestor, node):
+        """Является ли ancestor предком node (или самим node)"""
+        a, b = self.ids[ancestor], self.ids[node]
+        return bool(self._first[a] <= self._first[b] and self._last[b] <= self._last[a])
+
+    def ancestor(self, node, k):
+        """Предок node на k ребер выше или None, если поднялись выше корня"""
+        node_id = self.ids[node]
+        target = int(self.depth[node_id]) - k
+        if target < 0:
+            return None
+        level = self._levels[target]
+        # Предок - последний узел этой глубины, обойденный не позже node
+        return self.keys[level[bisect_right(level, node_id) - 1]]
+
+    def path_ops(self, node):
+        """Операции от корня до node: [('op_type', value), ...]"""
+        node_id = self.ids[node]
+        ops = []
+        parent = self._parent
+        while node_id > 0:
+            ops.append(self._ops[node_id])
+            node_id = parent[node_id]
+        ops.reverse()
+        return ops
+
+    def to_ids(self, nodes):
+        """Массив id для имен узлов"""
+        ids = self.ids
+        return np.fromiter((ids[node] for node in nodes), dtype=np.int64)
+
+    def lca_ids(self, u, v):
+        """LCA для массивов id u и v (пакетно, через NumPy), возвращает массив id"""
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        left = np.minimum(self._first[u], self._first[v])
+        right = np.maximum(self._first[u], self._first[v])
+        levels = np.log2(right - left + 1).astype(np.int64)
+        result = np.empty(len(u), dtype=np.int64)
+        for level in np.unique(levels):
+            mask = levels == level
+            table = self._table[level]
+            a = table[left[mask]]
+            b = table[right[mask] - (1 << int(level)) + 1]
+            result[mask] = np.where(self.depth[a] <= self.depth[b], a, b)
+        return result
+
+    def lca_many(self, pairs):
+        """LCA для списка пар имен узлов (пакетно), возвращает список имен"""
+        pairs = list(pairs)
+        lca = self.lca_ids(self.to_ids(u for u, _ in pairs), self.to_ids(v for _, v in pairs))
+        return [self.keys[node_id] for node_id in lca]
+
+    def distances(self, pairs):
+        """Расстояния (в ребрах) для списка пар имен узлов, возвращает массив NumPy"""
+        pairs = list(pairs)
+        u = self.to_ids(u for u, _ in pairs)
+        v = self.to_ids(v for _, v in pairs)
+        return self.depth[u] + self.depth[v] - 2 * self.depth[self.lca_ids(u, v)]
@@ -0,0 +1,238 @@
+import json
+import platform
+import random
+import string
+import sys
+import time
+
+from genetic import EvolutionTree, build_optimal_tree
+from strategies import get_strategy
+
+# Размеры наборов листьев по умолчанию; для проверки на больших наборах: --scales 1000 10000 100000
+DEFAULT_SCALES = (100, 1000, 10000)
+
+# Полная сборка квадратична по числу листьев: по умолчанию дерево целиком
+# строится только для наборов не больше этого размера
+BUILD_LIMIT = 1000
+
+# Во сколько раз замер может быть медленнее базового, прежде чем считаться регрессией
+REGRESSION_THRESHOLD = 1.25
+
+# Сколько раз повторять быстрые замеры (берется лучшее время)
+REPEAT = 3
+
+# Параметры прогона, которые должны совпадать, чтобы замеры можно было сравнивать
+COMPARED_META = ("length", "alphabet_size", "distance", "seed", "options")
+
+
+def random_word(rng, length, alphabet):
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def mutate(rng, word, distance, alphabet):
+    """Применить к строке distance случайных вставок, удалений и замен символов"""
+    chars = list(word)
+    for _ in range(distance):
+        kind = rng.choice(("add", "del", "sub")) if chars else "add"
+        if kind == "add":
+            chars.insert(rng.randint(0, len(chars)), rng.choice(alphabet))
+        elif kind == "del":
+            del chars[rng.randrange(len(chars))]
+        else:
+            chars[rng.randrange(len(chars))] = rng.choice(alphabet)
+    return "".join(chars)
+
+
+def generate_dataset(leaf_count, length=20, alphabet_size=4, distance=3, seed=0):
+    """
+    Синтетический набор: случайный корень длины length над алфавитом из
+    alphabet_size букв и leaf_count разных листьев, каждый на расстоянии до
+    distance случайных правок от корня. При одном и том же seed набор одинаковый.
+    Возвращает (root, leaves).
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_lowercase[:alphabet_size]
+    root = random_word(rng, length, alphabet)
+    leaves = {}
+    attempts = 0
+    while len(leaves) < leaf_count and attempts < 20 * leaf_count:
+        attempts += 1
+        leaf = mutate(rng, root, rng.randint(1, distance), alphabet)
+        if leaf != root:
+            leaves[leaf] = None
+    return root, list(leaves)
+
+
+def _best_time(func, repeat=REPEAT):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_find_evolution_path(root, leaves, strategy=None):
+    """Путь от корня до каждого листа выбранной стратегией (по умолчанию жадной)"""
+    path = get_strategy(strategy).path
+
+    def run():
+        for leaf in leaves:
+            path(root, leaf)
+    return _best_time(run), len(leaves)
+
+
+def bench_add_path_to_tree(root, leaves, strategy=None):
+    """
+    Добавление путей от корня до всех листьев в новое дерево (без выбора узла).
+    Возвращает (время, число путей, построенное дерево).
+    """
+    path = get_strategy(strategy).path
+    paths = [(path(root, leaf), leaf) for leaf in leaves]
+    trees = []
+
+    def run():
+        tree = EvolutionTree(root, strategy=strategy)
+        for path, leaf in paths:
+            tree.add_path_to_tree(path, leaf, root)
+        trees[:] = [tree]
+    return _best_time(run), len(paths), trees[0]
+
+
+def bench_get_available_nodes(tree, calls=100):
+    """Повторные запросы открытых узлов готового дерева"""
+    def run():
+        for _ in range(calls):
+            tree.get_available_nodes()
+    return _best_time(run), calls
+
+
+def bench_build_optimal_tree(root, leaves, **options):
+    """Построение дерева целиком (один прогон: он самый долгий)"""
+    start = time.perf_counter()
+    tree = build_optimal_tree(root, leaves, **options)
+    return time.perf_counter() - start, len(leaves), tree
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, length=20, alphabet_size=4, distance=3, seed=0,
+                   build_limit=BUILD_LIMIT, progress=None, **options):
+    """
+    Прогнать замеры на каждом размере из scales. build_limit - не строить дерево
+    целиком для наборов больше этого размера (None - строить всегда). options передаются в build_optimal_tree.
+    progress(запись) вызывается после каждого замера.
+    Возвращает словарь {"meta": параметры и окружение, "results": [записи]},
+    запись - {"name", "leaves", "seconds", "calls", "per_call"} (+ "nodes", "max_depth" для сборки).
+    Для наборов больше build_limit get_available_nodes замеряется на дереве из
+    add_path_to_tree (в записи "tree": "add_path_to_tree").
+    """
+    results = []
+
+    def record(name, scale, seconds, calls, **extra):
+        entry = {"name": name, "leaves": scale, "seconds": seconds, "calls": calls,
+                 "per_call": seconds / calls if calls else None, **extra}
+        results.append(entry)
+        if progress:
+            progress(entry)
+
+    strategy = options.get("strategy")
+    for scale in scales:
+        root, leaves = generate_dataset(scale, length, alphabet_size, distance, seed)
+        record("find_evolution_path", scale, *bench_find_evolution_path(root, leaves, strategy))
+        seconds, calls, tree = bench_add_path_to_tree(root, leaves, strategy)
+        record("add_path_to_tree", scale, seconds, calls)
+        if build_limit is not None and scale > build_limit:
+            record("get_available_nodes", scale, *bench_get_available_nodes(tree), tree="add_path_to_tree")
+            continue
+        seconds, calls, tree = bench_build_optimal_tree(root, leaves, **options)
+        record("build_optimal_tree", scale, seconds, calls, nodes=len(tree.nodes), max_depth=tree.max_depth)
+        record("get_available_nodes", scale, *bench_get_available_nodes(tree))
+
+    meta = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "length": length,
+        "alphabet_size": alphabet_size,
+        "distance": distance,
+        "seed": seed,
+        # Стратегия записывается по имени всегда, даже если она не задана явно
+        "options": dict({key: value for key, value in options.items() if value},
+                        strategy=get_strategy(strategy).name),
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Сравнить два прогона (результаты run_benchmarks или загруженные JSON).
+    Возвращает регрессии - записи (name, leaves, базовое время, текущее время, отношение),
+    где текущий замер медленнее базового больше чем в threshold раз.
+    Прогоны с разными параметрами набора или построения (COMPARED_META) не
+    сравниваются: ValueError. Замеры на деревьях разного происхождения
+    (поле "tree") тоже не сравниваются.
+    """
+    current_meta = current.get("meta", {})
+    baseline_meta = baseline.get("meta", {})
+    for key in COMPARED_META:
+        if key in current_meta and key in baseline_meta and current_meta[key] != baseline_meta[key]:
+            raise ValueError(f"Прогоны с разными параметрами нельзя сравнивать: {key} = "
+                             f"{current_meta[key]!r} и {baseline_meta[key]!r} в базовом прогоне")
+
+    base = {(entry["name"], entry["leaves"], entry.get("tree")): entry["seconds"] for entry in baseline["results"]}
+    regressions = []
+    for entry in current["results"]:
+        key = (entry["name"], entry["leaves"], entry.get("tree"))
+        if key not in base or not base[key]:
+            continue
+        ratio = entry["seconds"] / base[key]
+        if ratio > threshold:
+            regressions.append((entry["name"], entry["leaves"], base[key], entry["seconds"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    """Командная строка: прогнать замеры, записать JSON и сравнить с прошлым прогоном"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Замеры производительности построения дерева")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), help="размеры наборов листьев")
+    parser.add_argument("--length", type=int, default=20, help="длина корня")
+    parser.add_argument("--alphabet", type=int, default=4, help="размер алфавита")
+    parser.add_argument("--distance", type=int, default=3, help="максимум правок от корня до листа")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--build-limit", type=int, default=BUILD_LIMIT,
+                        help="не строить дерево целиком для наборов больше N (0 - строить всегда)")
+    parser.add_argument("--strategy", choices=("greedy", "bitparallel"), help="по умолчанию жадная")
+    parser.add_argument("--prune", action="store_true", help="метод ветвей и границ")
+    parser.add_argument("--output", default="benchmark.json", help="файл для результатов")
+    parser.add_argument("--compare", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    def progress(entry):
+        print(f"{entry['name']:>22} {entry['leaves']:>8} листьев: {entry['seconds']:.4f} c")
+
+    report = run_benchmarks(args.scales, args.length, args.alphabet, args.distance, args.seed,
+                            build_limit=args.build_limit or None, progress=progress,
+                            strategy=args.strategy, prune=args.prune)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(report, baseline, args.threshold)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+        for name, scale, before, after, ratio in regressions:
+            print(f"Регрессия: {name} ({scale} листьев): {before:.4f} c -> {after:.4f} c (x{ratio:.2f})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,205 +1,730 @@
-from collections import defaultdict, deque
-from itertools import permutations
-from graphviz import Digraph
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from functools import partial
+from time import perf_counter, time
+import os
 import heapq
+import sys
+
+from storage import DictNodeStore, apply_operation
+from strategies import GreedyPathStrategy, get_strategy
+
+# Размер кэша путей по умолчанию (количество пар (w1, w2))
+PATH_CACHE_SIZE = 100000
+
+# Правила выбора среди кандидатов с равным score: узел, добавленный раньше или позже
+TIE_BREAKS = ("first", "last")
+
+# Минимальное количество кандидатов на один процесс при параллельной оценке:
+# меньшие наборы дешевле оценить в основном процессе
+PARALLEL_MIN_CHUNK = 256
+
+
+class PathCache:
+    """
+    LRU-кэш путей эволюции, ключ - пара строк (w1, w2).
+    maxsize=None - кэш без ограничения размера, maxsize=0 - кэш выключен.
+    """
+
+    def __init__(self, maxsize=PATH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.maxsize is None or self.maxsize > 0
+
+    def get(self, key):
+        """Вернуть значение из кэша или None, обновляя счетчики попаданий"""
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            # Вытесняем самую давно использованную пару
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+class BuildStats:
+    """
+    Счетчики и время фаз построения дерева (включаются параметром stats).
+    counters: leaves - добавлено листьев, scored - оценено кандидатов (длин путей),
+    nodes_created / nodes_reused - созданные и переиспользованные узлы пути,
+    clones_created - созданные клоны "_N".
+    timings: sort - сортировка окна по длине пути от корня, scan - обход индекса
+    открытых узлов (get_available_nodes), score - оценка кандидатов при выборе узла,
+    attach - добавление пути в дерево, clone_search - поиск имени клона, checkpoint.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = defaultdict(float)
+        self.max_candidates = 0
+        self.started = perf_counter()
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] += seconds
+
+    def add_candidates(self, count):
+        """Учесть количество кандидатов, оцененных для одного листа"""
+        self.counters["candidates"] += count
+        if count > self.max_candidates:
+            self.max_candidates = count
+
+    @property
+    def elapsed(self):
+        return perf_counter() - self.started
+
+    def as_dict(self):
+        leaves = self.counters["leaves"]
+        return {
+            "counters": dict(self.counters),
+            "timings": dict(self.timings),
+            "candidates_per_leaf": {
+                "mean": self.counters["candidates"] / leaves if leaves else 0,
+                "max": self.max_candidates,
+            },
+            "elapsed": self.elapsed,
+        }
+
+    def summary(self):
+        """Сводка в несколько строк для вывода в консоль"""
+        data = self.as_dict()
+        lines = [f"Время: {data['elapsed']:.3f} c, листьев: {self.counters['leaves']}, "
+                 f"кандидатов на лист: {data['candidates_per_leaf']['mean']:.1f} "
+                 f"(максимум {data['candidates_per_leaf']['max']})"]
+        lines.append(f"Узлы: создано {self.counters['nodes_created']}, переиспользовано "
+                     f"{self.counters['nodes_reused']}, клонов {self.counters['clones_created']}")
+        for phase, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            lines.append(f"  {phase}: {seconds:.3f} c")
+        return "\n".join(lines)
+
+
+class OpenNodeIndex:
+    """
+    Индекс открытых узлов (edge_count < max_edges).
+    Узлы хранятся в порядке добавления в дерево (от этого зависит выбор
+    среди кандидатов с одинаковым score) и дополнительно разложены
+    по корзинам: глубина -> количество ребер -> узлы.
+    Узлы задаются дескрипторами хранилища (nodes.handle): для словаря это
+    имя узла, для компактных хранилищ - целочисленный id.
+    Заполненный узел сохраняет свой порядковый номер: если он снова откроется
+    (remove_leaf), то займет прежнее место в порядке, а не встанет в конец.
+    """
+
+    def __init__(self, max_edges=3):
+        self.max_edges = max_edges
+        self._order = {}
+        self._closed = {}
+        self._unordered = False
+        self._next_seq = 0
+        self._buckets = defaultdict(partial(defaultdict, dict))
+
+    def add(self, node, depth, edge_count=0):
+        # Порядковый номер узла нужен для разрешения равенства score
+        seq = self._next_seq
+        self._next_seq += 1
+        if edge_count >= self.max_edges:
+            return
+        self._order[node] = (depth, edge_count, seq)
+        self._buckets[depth][edge_count][node] = None
+
+    def update(self, node, edge_count):
+        """Перенести узел в корзину с новым числом ребер или убрать его, если узел заполнен"""
+        entry = self._order.get(node)
+        if entry is None:
+            return
+        depth, old_edge_count, seq = entry
+        self._discard_from_bucket(node, depth, old_edge_count)
+        if edge_count >= self.max_edges:
+            del self._order[node]
+            self._closed[node] = seq
+        else:
+            self._order[node] = (depth, edge_count, seq)
+            self._buckets[depth][edge_count][node] = None
+
+    def reopen(self, node, depth, edge_count):
+        """Вернуть заполненный узел в индекс с его прежним порядковым номером"""
+        self._order[node] = (depth, edge_count, self._closed.pop(node))
+        self._buckets[depth][edge_count][node] = None
+        self._unordered = True
+
+    def remove(self, node):
+        """Убрать узел из индекса (например, удаленный из дерева)"""
+        self._closed.pop(node, None)
+        entry = self._order.pop(node, None)
+        if entry is not None:
+            self._discard_from_bucket(node, entry[0], entry[1])
+
+    def _discard_from_bucket(self, node, depth, edge_count):
+        by_edges = self._buckets[depth]
+        bucket = by_edges[edge_count]
+        del bucket[node]
+        if not bucket:
+            del by_edges[edge_count]
+            if not by_edges:
+                del self._buckets[depth]
+
+    def depths(self):
+        """Глубины, на которых есть открытые узлы, по возрастанию"""
+        return sorted(self._buckets)
+
+    def bucket(self, depth, edge_count):
+        """Открытые узлы с заданной глубиной и количеством ребер"""
+        return list(self._buckets.get(depth, {}).get(edge_count, ()))
+
+    def at_depth(self, depth):
+        """Тройки (node, edge_count, seq) открытых узлов на заданной глубине"""
+        result = []
+        for edge_count, bucket in self._buckets.get(depth, {}).items():
+            for node in bucket:
+                result.append((node, edge_count, self._order[node][2]))
+        return result
+
+    def items(self):
+        """Пары (node, (depth, edge_count, seq)) в порядке добавления узлов"""
+        if self._unordered:
+            # После reopen узлы восстанавливают порядок (почти упорядоченный список сортируется за O(n))
+            self._order = dict(sorted(self._order.items(), key=lambda item: item[1][2]))
+            self._unordered = False
+        return self._order.items()
+
+    def available(self, key, max_edges):
+        """Тройки (key(node), depth, edge_count) узлов с меньше чем max_edges ребрами в порядке добавления"""
+        return [(key(node), depth, edge_count) for node, (depth, edge_count, _) in self.items()
+                if edge_count < max_edges]
+
+    def entry(self, node):
+        """(depth, edge_count, seq) открытого узла"""
+        return self._order[node]
+
+    def seq(self, node):
+        """Порядковый номер открытого узла"""
+        return self._order[node][2]
+
+    def __contains__(self, node):
+        return node in self._order
+
+    def __len__(self):
+        return len(self._order)
+
+
+class CompactOpenNodeIndex:
+    """
+    Индекс открытых узлов для хранилищ с целочисленными id (CompactNodeStore
+    и производные) с тем же интерфейсом, что у OpenNodeIndex. Глубина и
+    количество ребер лежат в массивах по id (-1 ребер - узел не открыт), а
+    порядковый номер узла - сам id: хранилище выдает id в порядке создания.
+    Корзины - массивы id по глубинам с ленивым удалением: закрытые узлы
+    выбрасываются из массива, когда их в нем больше половины.
+    Около 11 байт на узел вместо кортежа и двух записей в словарях.
+    """
+
+    def __init__(self, max_edges=3):
+        self.max_edges = max_edges
+        self._depth = array("i")
+        self._edge_count = array("h")
+        self._listed = bytearray()
+        self._levels = {}
+        self._level_counts = {}
+        self._count = 0
+
+    def add(self, node, depth, edge_count=0):
+        if node >= len(self._depth):
+            grow = node + 1 - len(self._depth)
+            self._depth.extend([0] * grow)
+            self._edge_count.extend([-1] * grow)
+            self._listed.extend(bytes(grow))
+        self._depth[node] = depth
+        if edge_count < self.max_edges:
+            self._open(node, depth, edge_count)
+
+    def _open(self, node, depth, edge_count):
+        self._edge_count[node] = edge_count
+        self._count += 1
+        self._level_counts[depth] = self._level_counts.get(depth, 0) + 1
+        if not self._listed[node]:
+            self._listed[node] = 1
+            level = self._levels.get(depth)
+            if level is None:
+                level = self._levels[depth] = array("i")
+            level.append(node)
+
+    def _close(self, node):
+        depth = self._depth[node]
+        self._edge_count[node] = -1
+        self._count -= 1
+        self._level_counts[depth] -= 1
+        if not self._level_counts[depth]:
+            del self._level_counts[depth]
+            for stale in self._levels.pop(depth):
+                self._listed[stale] = 0
+
+    def update(self, node, edge_count):
+        """Записать новое число ребер узла или убрать его, если узел заполнен"""
+        if node >= len(self._edge_count) or self._edge_count[node] < 0:
+            return
+        if edge_count >= self.max_edges:
+            self._close(node)
+        else:
+            self._edge_count[node] = edge_count
+
+    def reopen(self, node, depth, edge_count):
+        """Вернуть заполненный узел в индекс (порядок определяется его id)"""
+        self._open(node, depth, edge_count)
+
+    def remove(self, node):
+        """Убрать узел из индекса (например, удаленный из дерева)"""
+        if node in self:
+            self._close(node)
+
+    def depths(self):
+        """Глубины, на которых есть открытые узлы, по возрастанию"""
+        return sorted(self._level_counts)
+
+    def _live(self, depth):
+        """Открытые узлы глубины depth; массив сжимается, если закрытых в нем больше половины"""
+        level = self._levels.get(depth, ())
+        edge_counts = self._edge_count
+        live = [node for node in level if edge_counts[node] >= 0]
+        if 2 * len(live) < len(level):
+            for node in level:
+                if edge_counts[node] < 0:
+                    self._listed[node] = 0
+            self._levels[depth] = array("i", live)
+        return live
+
+    def bucket(self, depth, edge_count):
+        """Открытые узлы с заданной глубиной и количеством ребер"""
+        return sorted(node for node in self._live(depth) if self._edge_count[node] == edge_count)
+
+    def at_depth(self, depth):
+        """Тройки (node, edge_count, seq) открытых узлов на заданной глубине"""
+        edge_counts = self._edge_count
+        return [(node, edge_counts[node], node) for node in self._live(depth)]
+
+    def items(self):
+        """Пары (node, (depth, edge_count, seq)) в порядке добавления узлов"""
+        depths = self._depth
+        return ((node, (depths[node], edge_count, node))
+                for node, edge_count in enumerate(self._edge_count) if edge_count >= 0)
+
+    def available(self, key, max_edges):
+        """Тройки (key(node), depth, edge_count) узлов с меньше чем max_edges ребрами в порядке добавления"""
+        depths = self._depth
+        return [(key(node), depths[node], edge_count) for node, edge_count in enumerate(self._edge_count)
+                if 0 <= edge_count < max_edges]
+
+    def entry(self, node):
+        """(depth, edge_count, seq) открытого узла"""
+        if node not in self:
+            raise KeyError(node)
+        return (self._depth[node], self._edge_count[node], node)
+
+    def seq(self, node):
+        """Порядковый номер открытого узла"""
+        return node
+
+    def __contains__(self, node):
+        return 0 <= node < len(self._edge_count) and self._edge_count[node] >= 0
+
+    def __len__(self):
+        return self._count
+
+
+class QGramIndex:
+    """
+    Инвертированный индекс q-грамм имен открытых узлов: q-грамма -> дескрипторы узлов.
+    Позволяет быстро найти узлы, имена которых больше всего похожи на лист.
+    """
+
+    def __init__(self, q=2):
+        self.q = q
+        # Словари вместо множеств: порядок обхода не зависит от хэшей строк
+        self._postings = defaultdict(dict)
+
+    def grams(self, text):
+        """Различные q-граммы строки в порядке появления (короткая строка - сама себе q-грамма)"""
+        q = self.q
+        if len(text) <= q:
+            return [text]
+        return list(dict.fromkeys(text[i:i + q] for i in range(len(text) - q + 1)))
+
+    def add(self, handle, name, seq=None):
+        """
+        Добавить узел. seq - функция порядкового номера узла: если задана,
+        узел встает на свое место по порядку, а не в конец (снова открытый узел).
+        """
+        for gram in self.grams(name):
+            postings = self._postings[gram]
+            postings[handle] = None
+            if seq is not None:
+                self._postings[gram] = dict.fromkeys(sorted(postings, key=seq))
+
+    def remove(self, handle, name):
+        for gram in self.grams(name):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.pop(handle, None)
+                if not postings:
+                    del self._postings[gram]
+
+    def top(self, text, k):
+        """До k дескрипторов с наибольшим числом общих q-грамм с text (при равенстве - кто встретился раньше)"""
+        counts = Counter()
+        for gram in self.grams(text):
+            counts.update(self._postings.get(gram, {}).keys())
+        return [handle for handle, _ in counts.most_common(k)]
+
 
 class EvolutionTree:
-    def __init__(self, root):
+    def __init__(self, root, path_cache_size=PATH_CACHE_SIZE, max_edges=3, node_store=None, strategy=None,
+                 qgram_size=None):
+        """
+        node_store - фабрика пустого хранилища узлов (по умолчанию DictNodeStore,
+        для больших деревьев - storage.CompactNodeStore).
+        strategy - стратегия поиска пути (strategies.PathStrategy или ее имя),
+        по умолчанию жадный алгоритм.
+        qgram_size - если задан, поддерживать индекс q-грамм открытых узлов (qgram_index).
+        Атрибут stats (BuildStats или None) включает счетчики построения.
+        """
         self.root = root
-        self.nodes = {root: {"children": [], "parent": None, "depth": 0, "op": None, "edge_count": 0, "name":root}}
+        self.strategy = get_strategy(strategy)
+        self.nodes = (node_store or DictNodeStore)()
+        self.nodes.create(root, None, 0, None, root)
         self.leaves = set()
         self.edge_count = defaultdict(int)
         self.edge_types = defaultdict(set)
         self.max_depth = 0  # Переменная для отслеживания максимальной глубины
+        self._depth_counts = Counter({0: 1})  # Количество узлов на каждой глубине
+        self.max_edges = max_edges
+        self.path_cache = PathCache(path_cache_size)
+        self.length_cache = PathCache(path_cache_size)
+        # Хранилища с целочисленными id обходятся массивами вместо словарей
+        index = CompactOpenNodeIndex if getattr(self.nodes, "integer_handles", False) else OpenNodeIndex
+        self.open_nodes = index(max_edges)
+        self.qgram_index = QGramIndex(qgram_size) if qgram_size else None
+        self.stats = None
+        # Реестр имен "имя_N": имя -> [первый свободный номер N, занятые номера
+        # больше него, клоны со свободными местами (в порядке создания)];
+        # пустые множество и словарь не хранятся (None): записей столько же, сколько имен
+        # с суффиксом, а у большинства из них нет ни того, ни другого
+        self._clones = {}
+        self._clone_base = {}
+        self._register_open(self.nodes.handle(root), root, 0)
         
     def find_evolution_path(self, w1, w2):
         """
-        Находит максимальную общую последовательность символов, где позиции в w2
-        не раньше, чем соответствующие позиции в w1.
-        Возвращает список операций в формате [('op_type', value), ...]
+        Путь эволюции от w1 к w2 с использованием кэша путей.
+        Возвращает новый список, его можно изменять без влияния на кэш.
         """
         w1 = str(w1)
         w2 = str(w2)
-        n1, n2 = len(w1), len(w2)
+        if not self.path_cache.enabled:
+            return self.strategy.path(w1, w2)
         
-        # Находим максимальную общую подпоследовательность
-        common = []
-        last = -1
-        list_ind_w1 = []
-        list_ind_w2 = []
-        
-        for i in range(n1):
-            if last == -1:
-                for j in range(min(i+1, n2)):
-                    if w1[i] == w2[j]:
-                        list_ind_w1.append(i)
-                        list_ind_w2.append(j)
-                        last = j
-                        break
-            else:
-                for j in range(last+1, min(last + i - list_ind_w1[-1] + 1, n2)):
-                    if w1[i] == w2[j]:
-                        list_ind_w1.append(i)
-                        list_ind_w2.append(j)
-                        last = j
-                        break
-        
-        # Строим операции на основе найденной общей подпоследовательности
-        operations = []
-        current_w2_pos = 0
-        current_w1_pos = 0
-        
-        # Обрабатываем символы до первой общей позиции
-        for i in range(len(list_ind_w2)):
-            if i == 0:
-                # Символы перед первым общим символом
-                for j in range(list_ind_w2[0]):
-                    if current_w1_pos < n1:
-                        operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
-                        current_w1_pos += 1
-                    else:
-                        operations.append(('add', w2[j]))
-                    current_w2_pos = j + 1
-            
-            # Добавляем общий символ (не добавляем операцию для совпадений)
-            if current_w1_pos < list_ind_w1[i]:
-                # Удаляем лишние символы из w1
-                for k in range(current_w1_pos, list_ind_w1[i]):
-                    operations.append(('del', w1[k]))
-            
-            current_w1_pos = list_ind_w1[i] + 1
-            current_w2_pos = list_ind_w2[i] + 1
-            
-            # Обрабатываем символы между общими символами
-            if i < len(list_ind_w2) - 1:
-                next_w2_pos = list_ind_w2[i+1]
-                for j in range(current_w2_pos, next_w2_pos):
-                    if current_w1_pos < n1:
-                        operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
-                        current_w1_pos += 1
-                    else:
-                        operations.append(('add', w2[j]))
-                    current_w2_pos = j + 1
-        
-        # Обрабатываем символы после последней общей позиции
-        # Оставшиеся символы в w2
-        for j in range(current_w2_pos, n2):
-            if current_w1_pos < n1:
-                operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
-                current_w1_pos += 1
-            else:
-                operations.append(('add', w2[j]))
-        
-        # Оставшиеся символы в w1 (удаления)
-        for k in range(current_w1_pos, n1):
-            operations.append(('del', w1[k]))
-        
-        # Оптимизация пути (группировка последовательных операций одного типа)
-        optimized_path = []
-        i = 0
-        
-        while i < len(operations):
-            op_type, value = operations[i]
-            
-            if op_type == 'del':
-                # Группируем последовательные удаления
-                delete_chars = [value]
-                j = i + 1
-                while j < len(operations) and operations[j][0] == 'del':
-                    delete_chars.append(operations[j][1])
-                    j += 1
-                
-                if len(delete_chars) > 1:
-                    optimized_path.append(('del', ''.join(delete_chars)))
-                    i = j
-                else:
-                    optimized_path.append(('del', value))
-                    i += 1
-            
-            elif op_type == 'add':
-                # Группируем последовательные добавления
-                add_chars = [value]
-                j = i + 1
-                while j < len(operations) and operations[j][0] == 'add':
-                    add_chars.append(operations[j][1])
-                    j += 1
-                
-                if len(add_chars) > 1:
-                    optimized_path.append(('add', ''.join(add_chars)))
-                    i = j
-                else:
-                    optimized_path.append(('add', value))
-                    i += 1
-            
-            else:  # sub
-                optimized_path.append(('sub', value))
-                i += 1
+        key = (w1, w2)
+        path = self.path_cache.get(key)
+        if path is None:
+            path = tuple(self.strategy.path(w1, w2))
+            self.path_cache.put(key, path)
+        return list(path)
+    
+    def path_length(self, w1, w2):
+        """Длина пути эволюции от w1 к w2 (без построения операций), с кэшем"""
+        if self.stats is not None:
+            self.stats.counters["scored"] += 1
+        return self._cached_length(str(w1), str(w2))
+    
+    def _cached_length(self, w1, w2):
+        # Без счетчика scored: им учитывается только оценка кандидатов при выборе узла
+        if not self.length_cache.enabled:
+            return self.strategy.length(w1, w2)
         
-        return optimized_path
+        key = (w1, w2)
+        length = self.length_cache.get(key)
+        if length is None:
+            length = self.strategy.length(w1, w2)
+            self.length_cache.put(key, length)
+        return length
     
     def add_node(self, parent, child, op, depth):
-        """Добавить узел в дерево"""
+        """Добавить узел в дерево (не более max_edges детей у узла)"""
         
         if depth > self.max_depth:
             self.max_depth = depth
         
+        stats = self.stats
         if child not in self.nodes:
             # Создаем новый узел
-            self.nodes[child] = {
-                "children": [],
-                "parent": parent,
-                "depth": depth,
-                "op": op,
-                "edge_count": 0,
-                "name": child
-            }
-            self.nodes[parent]["children"].append({
-                "node": child,
-                "op": op
-            })
-            self.nodes[parent]["edge_count"] += 1
-            return child
+            if stats is not None:
+                stats.counters["nodes_created"] += 1
+            return self.attach_node(parent, child, op, depth)
         
-        elif self.nodes[child]["edge_count"] < 3:
+        elif self.nodes.edge_count(child) < self.max_edges:
             # Узел существует и у него есть место для детей
             # Просто возвращаем существующий узел
+            if stats is not None:
+                stats.counters["nodes_reused"] += 1
             return child
         
         else:
-            # У узла уже 3 ребенка, создаем новый узел с уникальным именем
-            i = 1
-            while f"{child}_{i}" in self.nodes:
-                i += 1
-            
-            new_child_name = f"{child}_{i-1}"
-            if new_child_name in self.nodes and  self.nodes[new_child_name]["edge_count"] < 3:
-                return new_child_name
+            # У узла уже 3 ребенка: берем последний клон "_N" со свободным местом
+            # или создаем новый узел с уникальным именем
+            if stats is not None:
+                start = perf_counter()
+            clone = self._reusable_clone(child)
+            if stats is not None:
+                stats.add_time("clone_search", perf_counter() - start)
+                stats.counters["clones_created" if clone is None else "nodes_reused"] += 1
+                stats.counters["nodes_created"] += clone is None
+            if clone is not None:
+                return clone
             # Создаем новый узел
-            new_child_name = f"{child}_{i}"
-            self.nodes[new_child_name] = {
-                "children": [],
-                "parent": parent,
-                "depth": depth,
-                "op": op,
-                "edge_count": 0,
-                "name": child
-            }
-            self.nodes[parent]["children"].append({
-                "node": new_child_name,
-                "op": op
-            })
-            self.nodes[parent]["edge_count"] += 1
-            
-            return new_child_name
-    
-    def get_available_nodes(self, max_edges=3):
-        """Получить узлы, к которым можно добавить детей (меньше 3 ребер)"""
-        available = []
-        for node, data in self.nodes.items():
-            if data["edge_count"] < max_edges:
-                available.append((node, data["depth"], data["edge_count"]))
+            entry = self._clones.get(child)
+            return self.attach_node(parent, f"{child}_{1 if entry is None else entry[0]}", op, depth, name=child)
+    
+    def _reusable_clone(self, name):
+        """
+        Узел "name_N" со свободным местом или None, за O(1): сначала узел с
+        номером перед первым свободным (как при последовательном переборе имен),
+        затем последний созданный клон, у которого еще есть место.
+        """
+        entry = self._clones.get(name)
+        if entry is None:
+            return None
+        last = f"{name}_{entry[0] - 1}"
+        if last in self.nodes and self.nodes.edge_count(last) < self.max_edges:
+            return last
+        if entry[2]:
+            return next(reversed(entry[2]))
+        return None
+    
+    def _register_suffix(self, node, name):
+        """
+        Учесть узел с именем вида "имя_N" (клон или узел, чье имя так оканчивается):
+        номер N занят, а клон со свободными местами можно переиспользовать.
+        """
+        base, _, suffix = node.rpartition("_")
+        if not base or not suffix.isdigit() or str(int(suffix)) != suffix:
+            return
+        entry = self._clones.get(base)
+        if entry is None:
+            entry = self._clones[base] = [1, None, None]
+        number = int(suffix)
+        if number == entry[0]:
+            entry[0] += 1
+            occupied = entry[1]
+            while occupied and entry[0] in occupied:
+                occupied.discard(entry[0])
+                entry[0] += 1
+            if not occupied:
+                entry[1] = None
+        elif number > entry[0]:
+            if entry[1] is None:
+                entry[1] = set()
+            entry[1].add(number)
+        if name == base:
+            if entry[2] is None:
+                entry[2] = {}
+            entry[2][node] = None
+            self._clone_base[node] = base
+    
+    def _drop_open_clone(self, base, node):
+        """Убрать клон из списка клонов со свободными местами"""
+        entry = self._clones[base]
+        if entry[2] is not None:
+            entry[2].pop(node, None)
+            if not entry[2]:
+                entry[2] = None
+    
+    def _unregister_suffix(self, node):
+        """Освободить номер N удаленного узла "имя_N" (как если бы его никогда не было)"""
+        base, _, suffix = node.rpartition("_")
+        entry = self._clones.get(base)
+        if entry is None or not suffix.isdigit() or str(int(suffix)) != suffix:
+            return
+        number = int(suffix)
+        if 0 < number < entry[0]:
+            if number + 1 < entry[0]:
+                entry[1] = (entry[1] or set()) | set(range(number + 1, entry[0]))
+            entry[0] = number
+        elif entry[1] is not None and number in entry[1]:
+            entry[1].discard(number)
+            if not entry[1]:
+                entry[1] = None
+        if entry == [1, None, None] and f"{base}_0" not in self.nodes:
+            del self._clones[base]
+    
+    def attach_node(self, parent, node, op, depth, name=None):
+        """
+        Создать узел с точно заданным именем и присоединить его к parent
+        (без проверки ограничения на число детей). name - исходное имя клона.
+        """
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if name is None:
+            name = node
+        handle = self.nodes.create(node, parent, depth, op, name)
+        self._depth_counts[depth] += 1
+        self._register_open(handle, name, depth)
+        if "_" in node:
+            self._register_suffix(node, name)
+        self._link_child(parent, node, op)
+        return node
+    
+    def remove_leaf(self, leaf):
+        """
+        Удалить лист: снять отметку листа и удалить узлы, которые больше не ведут
+        ни к одному листу (узел листа, его клоны без детей и освободившиеся
+        промежуточные узлы вверх по дереву). Родители получают свободные места и
+        снова становятся открытыми на прежнем месте в порядке выбора, номера
+        удаленных клонов освобождаются, max_depth пересчитывается. Цепочки, которые
+        и до удаления не вели к листу (путь закончился на уже существующем узле
+        в другом месте дерева), не затрагиваются.
+        Возвращает количество удаленных узлов.
+        """
+        if leaf not in self.leaves:
+            raise ValueError(f"{leaf!r} не является листом дерева")
+        self.leaves.discard(leaf)
+        
+        entry = self._clones.get(leaf)
+        candidates = [leaf] + (list(entry[2]) if entry is not None and entry[2] else [])
+        removed = 0
+        for node in candidates:
+            while (node in self.nodes and node != self.root and node not in self.leaves
+                   and not self.nodes.edge_count(node)):
+                parent = self.nodes[node]["parent"]
+                self._remove_node(node)
+                removed += 1
+                node = parent
+        
+        while self.max_depth and not self._depth_counts[self.max_depth]:
+            del self._depth_counts[self.max_depth]
+            self.max_depth -= 1
+        return removed
+    
+    def attach_leaf(self, leaf):
+        """Добавить лист к лучшему открытому узлу (как TreeBuilder.insert), вернуть этот узел"""
+        best_node, best_path = _select_candidate_pruned(self, leaf)
+        self.add_path_to_tree(best_path, leaf, best_node)
+        self.leaves.add(leaf)
+        return best_node
+    
+    def replace_leaf(self, old_leaf, new_leaf):
+        """Заменить лист: удалить old_leaf и добавить new_leaf к лучшему открытому узлу"""
+        self.remove_leaf(old_leaf)
+        return self.attach_leaf(new_leaf)
+    
+    def _remove_node(self, node):
+        """Удалить узел без детей и обновить индексы: родитель снова открыт"""
+        handle = self.nodes.handle(node)
+        name = self.nodes.name(node)
+        depth = self.nodes.depth(node)
+        parent = self.nodes[node]["parent"]
+        if handle in self.open_nodes:
+            self.open_nodes.remove(handle)
+            if self.qgram_index is not None:
+                self.qgram_index.remove(handle, name)
+        base = self._clone_base.pop(node, None)
+        if base is not None:
+            self._drop_open_clone(base, node)
+        if "_" in node:
+            self._unregister_suffix(node)
+        
+        edge_count = self.nodes.remove(node)
+        self._depth_counts[depth] -= 1
+        
+        parent_handle = self.nodes.handle(parent)
+        if parent_handle in self.open_nodes:
+            self.open_nodes.update(parent_handle, edge_count)
+        else:
+            # Заполненный родитель снова открыт и занимает прежнее место в порядке
+            # выбора, поэтому дерево ведет себя так же, как загруженное из снимка
+            self.open_nodes.reopen(parent_handle, self.nodes.depth(parent), edge_count)
+            if self.qgram_index is not None:
+                self.qgram_index.add(parent_handle, self.nodes.name(parent), self.open_nodes.seq)
+            parent_base = self._clone_base.get(parent)
+            if parent_base is not None:
+                entry = self._clones[parent_base]
+                clones = list(entry[2] or ()) + [parent]
+                seq = self.open_nodes.seq
+                handle = self.nodes.handle
+                entry[2] = dict.fromkeys(sorted(clones, key=lambda clone: seq(handle(clone))))
+    
+    def build_qgram_index(self, q=2):
+        """Построить индекс q-грамм по уже существующим открытым узлам"""
+        self.qgram_index = QGramIndex(q)
+        for handle, _ in self.open_nodes.items():
+            self.qgram_index.add(handle, self.nodes.name(self.nodes.key(handle)))
+    
+    def _register_open(self, handle, name, depth):
+        """Добавить новый узел в индексы открытых узлов"""
+        self.open_nodes.add(handle, depth)
+        if self.qgram_index is not None:
+            self.qgram_index.add(handle, name)
+    
+    def _link_child(self, parent, child, op):
+        """Добавить ребро parent -> child и обновить индексы открытых узлов"""
+        edge_count = self.nodes.attach(parent, child, op)
+        handle = self.nodes.handle(parent)
+        self.open_nodes.update(handle, edge_count)
+        if edge_count >= self.max_edges:
+            if self.qgram_index is not None:
+                self.qgram_index.remove(handle, self.nodes.name(parent))
+            base = self._clone_base.get(parent)
+            if base is not None:
+                self._drop_open_clone(base, parent)
+    
+    def get_available_nodes(self, max_edges=None):
+        """
+        Получить узлы, к которым можно добавить детей (меньше max_edges ребер).
+        По умолчанию max_edges равен ограничению дерева (3). Ответ строится
+        по индексу открытых узлов, а не полным обходом self.nodes.
+        """
+        if self.stats is None:
+            return self._available_nodes(max_edges)
+        start = perf_counter()
+        available = self._available_nodes(max_edges)
+        self.stats.add_time("scan", perf_counter() - start)
         return available
     
+    def _available_nodes(self, max_edges):
+        if max_edges is None:
+            max_edges = self.max_edges
+        
+        if max_edges > self.max_edges:
+            # Индекс не хранит заполненные узлы, нужен полный обход
+            available = []
+            for node, data in self.nodes.items():
+                if data["edge_count"] < max_edges:
+                    available.append((node, data["depth"], data["edge_count"]))
+            return available
+        
+        return self.open_nodes.available(self.nodes.key, max_edges)
+    
     # def get_available_nodes_viktar(self, max_edges=3):
     #     """Получить узлы, к которым можно добавить детей (меньше 3 ребер)"""
     #     return map(lambda node, data: (node, data["depth"], data["edge_count"]), filter(lambda _node, data: data["edge_count"] < max_edges, self.nodes.items()))
@@ -207,21 +732,13 @@ class EvolutionTree:
    
     def add_path_to_tree(self, path_sequence, leaf, current_node):
             
-        depth = self.nodes[current_node]["depth"]
+        depth = self.nodes.depth(current_node)
         
         for i, (op_type, op_value) in enumerate(path_sequence):
             # Генерируем имя дочернего узла на основе ТЕКУЩЕГО узла
             current_node_name = current_node  # Сохраняем текущее имя
             
-            if op_type == "add":
-                child_node = current_node_name + op_value
-            elif op_type == "del":
-                child_node = current_node_name.replace(op_value, "", 1)
-            elif op_type == "sub":
-                old, new = op_value.split("→")
-                child_node = current_node_name.replace(old, new, 1)
-            else:
-                child_node = current_node_name
+            child_node = apply_operation(current_node_name, (op_type, op_value))
             
             # Если это последняя операция, используем leaf как имя
             if i == len(path_sequence) - 1 and leaf:
@@ -242,81 +759,523 @@ class EvolutionTree:
         
         return current_node
 
-    def visualize(self):
-        dot = Digraph()
-        dot.attr('node', shape='box', style='rounded')
-        
-        for node, data in self.nodes.items():
-            label = f"{node}\n(depth: {data['depth']}, edges: {data['edge_count']})"
-            if node in self.leaves:
-                dot.node(node, label, color='green', penwidth='2')
-            else:
-                dot.node(node, label)
-            
-            for child in data["children"]:
-                op = child["op"]
-                edge_color = {
-                    "add": "green",
-                    "del": "red",
-                    "sub": "blue"
-                }[op[0]]
-                dot.edge(node, child["node"], label=op[1], color=edge_color, fontcolor=edge_color)
+    def visualize(self, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+        """
+        Граф Graphviz для дерева или его части: subtree - только поддерево узла,
+        max_depth - глубина относительно начального узла, leaves - только пути
+        к этим листьям, collapse_chains - сворачивать цепочки с одним ребенком.
+        """
+        return self.render("graphviz", subtree=subtree, max_depth=max_depth, leaves=leaves,
+                           collapse_chains=collapse_chains)
+    
+    def write_dot(self, out, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+        """Записать дерево в DOT-файл потоково, без построения графа в памяти (см. render.write_dot)"""
+        return self.render("dot", out, subtree=subtree, max_depth=max_depth, leaves=leaves,
+                           collapse_chains=collapse_chains)
+    
+    def render(self, backend="graphviz", *args, **options):
+        """
+        Отрисовать или экспортировать дерево: backend - "graphviz", "dot", "json"
+        или способ, добавленный через render.register_backend. Модуль отрисовки
+        загружается только при вызове.
+        """
+        from render import render
+        return render(self, backend, *args, **options)
+
+def _select_candidate(tree, leaf, prefer_last=False):
+    """
+    Полный перебор открытых узлов: вернуть (узел, путь) с минимальным
+    score = (глубина + длина пути, количество ребер). Для кандидатов
+    считается только длина пути, сам путь строится один раз для победителя.
+    prefer_last - при равенстве score брать узел, добавленный позже.
+    """
+    best_score = None
+    best_node = None
+    for node, depth_node, edge_count in tree.get_available_nodes():
+        depth_increase = tree.path_length(tree.nodes.name(node), leaf) + depth_node
+        score = (depth_increase, edge_count)
+        # Строгое сравнение: при равенстве остается узел, добавленный раньше
+        if best_score is None or score < best_score or prefer_last and score == best_score:
+            best_score = score
+            best_node = node
+    
+    return best_node, tree.find_evolution_path(tree.nodes.name(best_node), leaf)
+
+
+def _select_candidate_pruned(tree, leaf, best=None, best_node=None):
+    """
+    Метод ветвей и границ: кандидаты просматриваются по возрастанию
+    (глубина + нижняя оценка пути), перебор прекращается, как только оценка
+    не может улучшить лучший найденный score. Результат совпадает с полным
+    перебором: при равенстве score побеждает узел, добавленный раньше.
+    best, best_node - уже известный кандидат (ключ (score, ребра, seq) и узел),
+    с которого начинается отсечение.
+    """
+    leaf_counts = Counter(leaf)
+    depths = tree.open_nodes.depths()
+    next_depth = 0
+    heap = []
+    
+    while True:
+        # Добавляем в кучу глубины, узлы которых могут оказаться не хуже вершины кучи
+        while next_depth < len(depths) and (not heap or depths[next_depth] <= heap[0][0][0]):
+            depth = depths[next_depth]
+            next_depth += 1
+            for handle, edge_count, seq in tree.open_nodes.at_depth(depth):
+                node = tree.nodes.key(handle)
+                bound = tree.strategy.lower_bound(tree.nodes.name(node), leaf, leaf_counts)
+                heapq.heappush(heap, ((depth + bound, edge_count, seq), node, depth))
         
-        # Добавляем информацию о максимальной глубине
-        dot.attr(label=f"Глубина дерева: {self.max_depth}", labelloc="t", labeljust="c")
+        if not heap:
+            break
+        bound_score, node, depth = heapq.heappop(heap)
+        if best is not None and bound_score >= best:
+            break
         
-        return dot
+        score = (depth + tree.path_length(tree.nodes.name(node), leaf), bound_score[1], bound_score[2])
+        if best is None or score < best:
+            best, best_node = score, node
+    
+    return best_node, tree.find_evolution_path(tree.nodes.name(best_node), leaf)
+
 
-def build_optimal_tree(root, leaves):
-    tree = EvolutionTree(root)
-    tree.leaves = set(leaves)
+def _select_candidate_shortlist(tree, leaf, shortlist, exact_fallback=False):
+    """
+    Оценка только shortlist открытых узлов с наибольшим числом общих с листом
+    q-грамм. Если exact_fallback, лучший из них используется как начальная
+    граница для метода ветвей и границ по всем узлам, и результат совпадает
+    с полным перебором.
+    """
+    best = None
+    best_node = None
+    for handle in tree.qgram_index.top(leaf, shortlist):
+        depth, edge_count, seq = tree.open_nodes.entry(handle)
+        node = tree.nodes.key(handle)
+        score = (depth + tree.path_length(tree.nodes.name(node), leaf), edge_count, seq)
+        if best is None or score < best:
+            best, best_node = score, node
     
-    # Шаг 1: Находим все пути до листьев и сортируем по длине
-    paths = []
-    for leaf in leaves:
-        path = tree.find_evolution_path(root, leaf)
-        paths.append((len(path), path, leaf))
-    paths.sort(key=lambda x: x[0], reverse=True)
-    longest_path_length, longest_path, longest_leaf = paths[0]
+    if exact_fallback or best_node is None:
+        return _select_candidate_pruned(tree, leaf, best, best_node)
+    return best_node, tree.find_evolution_path(tree.nodes.name(best_node), leaf)
+
+
+def _score_chunk(leaf, strategy, chunk):
+    """
+    Оценить часть кандидатов в процессе-обработчике.
+    chunk - список (позиция, имя узла, глубина, количество ребер),
+    возвращает минимальный ключ (глубина + длина пути, ребра, позиция).
+    """
+    best = None
+    for position, name, depth, edge_count in chunk:
+        key = (depth + strategy.length(name, leaf), edge_count, position)
+        if best is None or key < best:
+            best = key
+    return best
+
+
+def _select_candidate_parallel(tree, leaf, pool, workers):
+    """
+    Оценка кандидатов в пуле процессов. Открытые узлы делятся на части,
+    каждая часть возвращает свой минимум, итоговый минимум берется по
+    (score, позиция узла), поэтому выбор совпадает с последовательным.
+    """
+    available_nodes = tree.get_available_nodes()
+    if len(available_nodes) < 2 * PARALLEL_MIN_CHUNK:
+        return _select_candidate(tree, leaf)
     
-    tree.add_path_to_tree(longest_path, longest_leaf, root)
+    candidates = [(position, tree.nodes.name(node), depth, edge_count)
+                  for position, (node, depth, edge_count) in enumerate(available_nodes)]
+    chunk_size = max(PARALLEL_MIN_CHUNK, -(-len(candidates) // workers))
+    chunks = [candidates[i:i + chunk_size] for i in range(0, len(candidates), chunk_size)]
     
-            
-    leaves = []     
-    for _,_, leaf in paths[1:]:
-        best_candidates = []
-        available_nodes = tree.get_available_nodes()
-        for node, depth_node, edge_count in available_nodes:
-            path = tree.find_evolution_path(tree.nodes[node]["name"], leaf)
-
-            depth_increase = len(path) + depth_node
-            
-            edges_available = edge_count
-            
-            # Добавляем кандидата с его критериями
-            best_candidates.append({
-                'node': node,
-                'path_remainder': path,
-                'score': (depth_increase, edges_available) 
-            })
+    if tree.stats is not None:
+        tree.stats.counters["scored"] += len(candidates)
+    best = min(pool.map(partial(_score_chunk, leaf, tree.strategy), chunks))
+    best_node = available_nodes[best[2]][0]
+    return best_node, tree.find_evolution_path(tree.nodes.name(best_node), leaf)
+
+
+class TreeBuilder:
+    """
+    Инкрементальное построение дерева: листья добавляются по одному из любого
+    итератора (файл, генератор) по тому же правилу выбора открытого узла,
+    что и в build_optimal_tree. Дерево (builder.tree) можно смотреть в любой момент.
+    
+    window - если задан, листья копятся в окне из window штук, окно сортируется
+    по длине пути от корня (от самого длинного), как в build_optimal_tree,
+    и только потом добавляется. Без window каждый лист добавляется сразу.
+    tree - уже частично построенное дерево (например, из snapshot.load_tree),
+    которое нужно достроить; листья, которые в нем уже есть, пропускаются.
+    checkpoint_path, checkpoint_every - сохранять снимок дерева (snapshot.save_tree)
+    после каждых checkpoint_every добавленных листьев.
+    stats - собирать счетчики и время фаз (BuildStats в builder.stats и tree.stats).
+    progress - функция progress(добавлено, всего, прошло секунд, осталось секунд),
+    вызывается после каждого листа; всего и оценка оставшегося времени известны
+    только для пакетного добавления (иначе None).
+    tie_break - "first" (по умолчанию) или "last": какой из кандидатов с равным
+    score выбирать; "last" поддерживается только полным перебором.
+    deadline - момент времени (time.time()), после которого добавление листа
+    прерывается исключением TimeoutError.
+    Остальные параметры - как у build_optimal_tree.
+    """
+    
+    def __init__(self, root, window=None, path_cache_size=PATH_CACHE_SIZE, max_edges=3, prune=False,
+                 workers=None, vectorized=False, node_store=None, strategy=None,
+                 shortlist=None, qgram_size=2, exact_fallback=False, tree=None,
+                 checkpoint_path=None, checkpoint_every=None, stats=False, progress=None,
+                 tie_break="first", deadline=None):
+        if sum(map(bool, (prune, workers, vectorized, shortlist))) > 1:
+            raise ValueError("prune, workers, vectorized и shortlist нельзя использовать одновременно")
+        if tie_break not in TIE_BREAKS:
+            raise ValueError(f"Неизвестное правило выбора при равенстве: {tie_break}")
+        if tie_break != "first" and (prune or workers or vectorized or shortlist):
+            raise ValueError("tie_break='last' поддерживается только полным перебором")
         
-        best_candidates.sort(key=lambda x: x['score'], reverse=False)
-        best_candidate = best_candidates[0]
-        best_node = best_candidate['node']
-        best_path = best_candidate['path_remainder']
-        path = tree.find_evolution_path(tree.nodes[best_node]["name"], leaf)
+        self.window = window
+        if tree is None:
+            tree = EvolutionTree(root, path_cache_size=path_cache_size, max_edges=max_edges,
+                                 node_store=node_store, strategy=strategy,
+                                 qgram_size=qgram_size if shortlist else None)
+        elif tree.root != root:
+            raise ValueError(f"Корень дерева {tree.root!r} не совпадает с {root!r}")
+        elif shortlist and tree.qgram_index is None:
+            tree.build_qgram_index(qgram_size)
+        self.tree = tree
+        if stats:
+            tree.stats = BuildStats()
+        self.stats = tree.stats
+        self.progress = progress
+        self.deadline = deadline
+        self._started = perf_counter()
+        self._done = 0
+        self._total = None
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self._since_checkpoint = 0
+        self._buffer = []
+        self._pool = None
         
-        tree.add_path_to_tree(best_path, leaf, best_node)
+        if shortlist:
+            self._select_candidate = partial(_select_candidate_shortlist, shortlist=shortlist,
+                                             exact_fallback=exact_fallback)
+        elif vectorized:
+            if not isinstance(self.tree.strategy, GreedyPathStrategy):
+                raise ValueError("vectorized поддерживает только жадную стратегию")
+            import vectorized as vectorized_scoring
+            self._select_candidate = vectorized_scoring.select_candidate
+        elif workers and workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+            self._select_candidate = partial(_select_candidate_parallel, pool=self._pool, workers=workers)
+        elif prune:
+            self._select_candidate = _select_candidate_pruned
+        elif tie_break == "last":
+            self._select_candidate = partial(_select_candidate, prefer_last=True)
+        else:
+            self._select_candidate = _select_candidate
+    
+    def insert(self, leaf):
+        """Сразу добавить лист в дерево, вернуть узел, от которого он подвешен"""
+        return self.attach(leaf)[0]
+    
+    def attach(self, leaf):
+        """Сразу добавить лист в дерево, вернуть (узел, от которого он подвешен, путь)"""
+        if self.deadline is not None and time() > self.deadline:
+            raise TimeoutError("Время на построение дерева истекло")
+        stats = self.stats
+        if stats is None:
+            best_node, best_path = self._select_candidate(self.tree, leaf)
+            self.tree.add_path_to_tree(best_path, leaf, best_node)
+        else:
+            start = perf_counter()
+            scored = stats.counters["scored"]
+            scan = stats.timings["scan"]
+            best_node, best_path = self._select_candidate(self.tree, leaf)
+            selected = perf_counter()
+            self.tree.add_path_to_tree(best_path, leaf, best_node)
+            # Обход открытых узлов учитывается в get_available_nodes, остальное время выбора - оценка
+            stats.add_time("score", selected - start - (stats.timings["scan"] - scan))
+            stats.add_time("attach", perf_counter() - selected)
+            stats.add_candidates(stats.counters["scored"] - scored)
+            stats.counters["leaves"] += 1
+        self.tree.leaves.add(leaf)
+        
+        if self.checkpoint_every:
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+        if self.progress is not None:
+            self._report_progress()
+        return best_node, best_path
+    
+    def _report_progress(self):
+        self._done += 1
+        elapsed = perf_counter() - self._started
+        eta = None
+        if self._total:
+            eta = elapsed / self._done * (self._total - self._done)
+        self.progress(self._done, self._total, elapsed, eta)
+    
+    def checkpoint(self, path=None):
+        """Сохранить снимок дерева (по умолчанию в checkpoint_path)"""
+        from snapshot import save_tree
+        start = perf_counter()
+        save_tree(self.tree, path or self.checkpoint_path)
+        self._since_checkpoint = 0
+        if self.stats is not None:
+            self.stats.add_time("checkpoint", perf_counter() - start)
+    
+    def insert_batch(self, leaves):
+        """Добавить набор листьев, начиная с самых длинных путей от корня"""
+        root = self.tree.root
+        done = self.tree.leaves
+        start = perf_counter()
+        batch = [(self.tree._cached_length(str(root), str(leaf)), leaf) for leaf in leaves if leaf not in done]
+        # Сортировка устойчивая: листья с равной длиной пути остаются в исходном порядке
+        batch.sort(key=lambda x: x[0], reverse=True)
+        if self.stats is not None:
+            self.stats.add_time("sort", perf_counter() - start)
         
+        if self.progress is not None and not self.window:
+            self._done, self._total = 0, len(batch)
+            self._started = perf_counter()
+        for _, leaf in batch:
+            self.insert(leaf)
+    
+    def add(self, leaf):
+        """Добавить лист (сразу или через окно); листья, которые уже есть в дереве, пропускаются"""
+        if leaf in self.tree.leaves:
+            return
+        if not self.window:
+            self.insert(leaf)
+            return
+        self._buffer.append(leaf)
+        if len(self._buffer) >= self.window:
+            self.flush()
+    
+    def extend(self, leaves):
+        """Добавить листья из итератора, не читая его целиком"""
+        for leaf in leaves:
+            self.add(leaf)
+        return self.tree
+    
+    def flush(self):
+        """Добавить листья, накопленные в окне"""
+        buffer, self._buffer = self._buffer, []
+        self.insert_batch(buffer)
+        return self.tree
+    
+    @property
+    def pending(self):
+        """Количество листьев в окне, еще не добавленных в дерево"""
+        return len(self._buffer)
+    
+    def close(self):
+        """Добавить оставшиеся листья и освободить пул процессов"""
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return self.tree
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def build_optimal_tree(root, leaves, path_cache_size=PATH_CACHE_SIZE, max_edges=3, prune=False,
+                       workers=None, vectorized=False, node_store=None, strategy=None,
+                       shortlist=None, qgram_size=2, exact_fallback=False, tree=None,
+                       checkpoint_path=None, checkpoint_every=None, stats=False, progress=None):
+    """
+    Построить дерево эволюции от root до всех leaves.
+    path_cache_size - размер LRU-кэша путей (0 - без кэша, None - без ограничения).
+    max_edges - максимальное количество детей у узла.
+    prune - выбирать узел методом ветвей и границ вместо полного перебора
+    (дерево получается таким же).
+    workers - количество процессов для параллельной оценки кандидатов
+    (дерево получается таким же, как при последовательной оценке).
+    vectorized - оценивать кандидатов пакетно через NumPy (модуль vectorized).
+    node_store - фабрика хранилища узлов (например, storage.CompactNodeStore).
+    strategy - стратегия поиска пути: "greedy" (по умолчанию), "bitparallel"
+    или экземпляр strategies.PathStrategy.
+    shortlist - оценивать только столько открытых узлов с наибольшим числом
+    общих с листом q-грамм (размер q-граммы - qgram_size). С exact_fallback
+    лучший из них служит начальной границей для точного перебора.
+    tree - частично построенное дерево (например, из snapshot.load_tree):
+    в него добавляются только листья, которых в нем еще нет.
+    checkpoint_path, checkpoint_every - периодически сохранять снимок дерева.
+    stats - собрать счетчики и время фаз построения в tree.stats (BuildStats).
+    progress - функция progress(добавлено, всего, прошло секунд, осталось секунд).
+    """
+    with TreeBuilder(root, path_cache_size=path_cache_size, max_edges=max_edges, prune=prune,
+                     workers=workers, vectorized=vectorized, node_store=node_store, strategy=strategy,
+                     shortlist=shortlist, qgram_size=qgram_size, exact_fallback=exact_fallback, tree=tree,
+                     checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                     stats=stats, progress=progress) as builder:
+        # Пути от корня сортируются по длине, первым добавляется самый длинный
+        # (для него единственный открытый узел - корень), затем остальные листья
+        builder.insert_batch(leaves)
+    return builder.tree
+
+
+
+def _multistart_orders(leaves, starts, seed, tie_breaks=TIE_BREAKS):
+    """
+    Варианты запуска (номер, порядок листьев, правило выбора при равенстве):
+    нулевой - исходный порядок, как у build_optimal_tree, остальные - листья,
+    перемешанные генератором с зерном seed + номер (сортировка по длине пути
+    от корня устойчивая, поэтому меняется порядок листьев с равной длиной),
+    правила из tie_breaks чередуются.
+    """
+    import random
+    
+    for start in range(starts):
+        order = list(leaves)
+        if start:
+            random.Random(seed + start).shuffle(order)
+        yield start, order, tie_breaks[start % len(tie_breaks)]
+
+
+def _multistart_build(root, leaves, tie_break, deadline, options):
+    """Одно построение мультистарта (в процессе-обработчике); None, если срок истек"""
+    try:
+        with TreeBuilder(root, tie_break=tie_break, deadline=deadline, **options) as builder:
+            builder.insert_batch(leaves)
+    except TimeoutError:
+        return None
+    tree = builder.tree
+    # Кэши не нужны вызывающему процессу, а передавать их дорого
+    tree.path_cache.clear()
+    tree.length_cache.clear()
     return tree
 
 
+def build_multistart(root, leaves, starts=4, workers=None, time_budget=None, seed=0, **options):
+    """
+    Построить несколько деревьев параллельно (в пуле из workers процессов) с разным
+    порядком листьев с равной длиной пути от корня и разным правилом выбора
+    среди равных кандидатов и вернуть дерево с наименьшим max_depth, затем с
+    наименьшим числом узлов. Нулевой запуск совпадает с build_optimal_tree,
+    поэтому результат не хуже обычного построения, если тот успел завершиться.
+    
+    time_budget - ограничение по времени в секундах: незавершенные к этому
+    сроку построения прерываются; если не завершилось ни одно, возникает
+    TimeoutError. options передаются в TreeBuilder (prune, strategy и т.д.);
+    правило "last" используется только при полном переборе.
+    В tree.multistart записываются номер выбранного запуска, его правило
+    выбора при равенстве и количество завершенных запусков.
+    """
+    leaves = list(leaves)
+    deadline = None if time_budget is None else time() + time_budget
+    full_scan = not any(options.get(name) for name in ("prune", "vectorized", "shortlist"))
+    runs = list(_multistart_orders(leaves, starts, seed, TIE_BREAKS if full_scan else TIE_BREAKS[:1]))
+    workers = min(workers or os.cpu_count() or 1, len(runs))
+    
+    results = []
+    if workers <= 1:
+        for start, order, tie_break in runs:
+            tree = _multistart_build(root, order, tie_break, deadline, options)
+            if tree is not None:
+                results.append((start, tie_break, tree))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_multistart_build, root, order, tie_break, deadline, options): (start, tie_break)
+                       for start, order, tie_break in runs}
+            for future, (start, tie_break) in futures.items():
+                tree = future.result()
+                if tree is not None:
+                    results.append((start, tie_break, tree))
+    
+    if not results:
+        raise TimeoutError("Ни одно построение не завершилось за отведенное время")
+    start, tie_break, tree = min(results, key=lambda item: (item[2].max_depth, len(item[2].nodes), item[0]))
+    tree.multistart = {"start": start, "tie_break": tie_break, "finished": len(results), "starts": len(runs)}
+    return tree
 
-if __name__ == "__main__":
-    from tree_data import root, leaves
+
+def _print_progress(done, total, elapsed, eta):
+    """Ход построения для командной строки (одна обновляемая строка в stderr)"""
+    remaining = "" if eta is None else f", осталось ~{eta:.0f} c"
+    print(f"\rЛистьев: {done}{'' if total is None else f'/{total}'}, {elapsed:.0f} c{remaining}",
+          end="", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    """
+    Командная строка: построить дерево по файлу листьев и отрисовать его.
+    Без --leaves корень и листья берутся из tree_data.py.
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Построение дерева эволюции строк")
+    parser.add_argument("--leaves", help="файл листьев (по строке на лист, FASTA, можно .gz)")
+    parser.add_argument("--root", help="корень дерева (по умолчанию - первая запись файла листьев)")
+    parser.add_argument("--format", choices=("lines", "fasta"), help="формат файла листьев")
+    parser.add_argument("--dedupe", action="store_true", help="пропускать повторяющиеся листья")
+    parser.add_argument("--window", type=int, help="строить потоково, окнами из N листьев")
+    parser.add_argument("--strategy", default="greedy", choices=("greedy", "bitparallel"))
+    parser.add_argument("--prune", action="store_true", help="метод ветвей и границ")
+    parser.add_argument("--workers", type=int, help="количество процессов для оценки кандидатов")
+    parser.add_argument("--output", default="evolution_tree", help="имя файла изображения")
+    parser.add_argument("--no-view", action="store_true", help="не открывать изображение")
+    parser.add_argument("--no-render", action="store_true", help="не рисовать дерево, только вывести сводку")
+    parser.add_argument("--starts", type=int, help="построить N деревьев с разным порядком листьев и взять лучшее")
+    parser.add_argument("--time-budget", type=float, help="ограничение времени мультистарта в секундах")
+    parser.add_argument("--stats", action="store_true", help="вывести счетчики и время фаз построения")
+    parser.add_argument("--progress", action="store_true", help="показывать ход построения")
+    parser.add_argument("--dot", help="записать дерево в DOT-файл потоково вместо рисования через Graphviz")
+    parser.add_argument("--json", help="экспортировать дерево в JSON-файл")
+    parser.add_argument("--subtree", help="показывать только поддерево узла")
+    parser.add_argument("--max-render-depth", type=int, help="глубина показываемых узлов от начального узла")
+    parser.add_argument("--show-leaf", action="append", help="показывать только пути к этому листу (можно несколько)")
+    parser.add_argument("--collapse-chains", action="store_true", help="сворачивать цепочки узлов с одним ребенком")
+    args = parser.parse_args(argv)
     
-    tree = build_optimal_tree(root, leaves)
-    dot = tree.visualize()
-    dot.render('evolution_tree', view=True, format='png')
+    if args.leaves:
+        from loader import load_root_and_leaves
+        root, leaves = load_root_and_leaves(args.leaves, root=args.root, fmt=args.format, dedupe=args.dedupe)
+    else:
+        from tree_data import root, leaves
+        root = args.root or root
     
-    
\ No newline at end of file
+    options = dict(strategy=args.strategy, prune=args.prune, workers=args.workers, stats=args.stats)
+    if args.progress:
+        options["progress"] = _print_progress
+    if args.starts:
+        options.pop("progress", None)
+        del options["workers"]
+        tree = build_multistart(root, leaves, starts=args.starts, workers=args.workers,
+                                time_budget=args.time_budget, **options)
+    elif args.window:
+        with TreeBuilder(root, window=args.window, **options) as builder:
+            builder.extend(leaves)
+            tree = builder.close()
+    else:
+        tree = build_optimal_tree(root, leaves, **options)
+    
+    if args.progress:
+        print(file=sys.stderr)
+    print(f"Узлов: {len(tree.nodes)}, листьев: {len(tree.leaves)}, глубина дерева: {tree.max_depth}")
+    if tree.stats is not None:
+        print(tree.stats.summary())
+    render_options = dict(subtree=args.subtree, max_depth=args.max_render_depth, leaves=args.show_leaf,
+                          collapse_chains=args.collapse_chains)
+    if args.json:
+        tree.render("json", args.json, **render_options)
+    if args.dot:
+        tree.write_dot(args.dot, **render_options)
+    elif not args.no_render:
+        dot = tree.visualize(**render_options)
+        dot.render(args.output, view=not args.no_view, format='png')
+    return tree
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import gzip
+import mmap
+import os
+
+# Расширения файлов в FASTA-подобном формате
+FASTA_EXTENSIONS = (".fa", ".fasta", ".fna")
+
+
+def _detect_format(path):
+    """Формат по расширению: "fasta" для .fa/.fasta/.fna (в том числе .gz), иначе "lines" """
+    name = path[:-3] if path.endswith(".gz") else path
+    return "fasta" if name.endswith(FASTA_EXTENSIONS) else "lines"
+
+
+def _iter_lines_mmap(path):
+    """Строки файла (bytes без перевода строки) через mmap, без чтения файла целиком"""
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = 0
+        size = len(mm)
+        while position < size:
+            end = mm.find(b"\n", position)
+            if end == -1:
+                end = size
+            yield mm[position:end]
+            position = end + 1
+
+
+def _iter_lines_gzip(path):
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            yield line.rstrip(b"\n")
+
+
+def _iter_records(lines, fmt):
+    """Записи (bytes) из строк: по одной на строку или FASTA-записи (заголовок ">" и строки последовательности)"""
+    if fmt == "lines":
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if line:
+                yield line
+        return
+
+    parts = None
+    for line in lines:
+        line = line.rstrip(b"\r")
+        if line.startswith(b">"):
+            if parts is not None:
+                yield b"".join(parts)
+            parts = []
+        elif line and not line.startswith(b";"):
+            if parts is None:
+                # Последовательность без заголовка - отдельная запись
+                parts = []
+            parts.append(line.strip())
+    if parts is not None:
+        yield b"".join(parts)
+
+
+def iter_leaves(path, fmt=None, dedupe=False, encoding="utf-8"):
+    """
+    Лениво читать листья из файла.
+    fmt - "lines" (по листу на строку) или "fasta" (записи с заголовками ">"),
+    по умолчанию определяется по расширению. Файлы .gz читаются потоково,
+    остальные - через mmap. dedupe - пропускать повторяющиеся листья.
+    """
+    fmt = fmt or _detect_format(path)
+    if fmt not in ("lines", "fasta"):
+        raise ValueError(f"Неизвестный формат файла листьев: {fmt}")
+
+    lines = _iter_lines_gzip(path) if path.endswith(".gz") else _iter_lines_mmap(path)
+    seen = set() if dedupe else None
+    for record in _iter_records(lines, fmt):
+        if seen is not None:
+            if record in seen:
+                continue
+            seen.add(record)
+        yield record.decode(encoding)
+
+
+def load_root_and_leaves(path, root=None, fmt=None, dedupe=False, encoding="utf-8"):
+    """
+    Вернуть (root, итератор листьев) из файла.
+    Если root не задан, корнем считается первая запись файла.
+    """
+    leaves = iter_leaves(path, fmt=fmt, dedupe=dedupe, encoding=encoding)
+    if root is None:
+        root = next(leaves, None)
+        if root is None:
+            raise ValueError(f"Файл {path} не содержит ни одной записи")
+    return root, leaves
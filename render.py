@@ -0,0 +1,217 @@
+"""
+Отрисовка и экспорт дерева. Модуль не зависит от сторонних пакетов: Graphviz
+импортируется только при вызове соответствующего способа отрисовки, поэтому
+процессы, которые только строят деревья, его не загружают.
+"""
+import importlib
+import json
+import os
+
+# Цвета ребер по типу операции
+EDGE_COLORS = {
+    "add": "green",
+    "del": "red",
+    "sub": "blue"
+}
+
+
+def _start_node(tree, subtree):
+    start = tree.root if subtree is None else subtree
+    if start not in tree.nodes:
+        raise ValueError(f"Узел {start!r} не найден в дереве")
+    return start
+
+
+def _ancestors(tree, start, leaves):
+    """Узлы на путях от start до заданных листьев (листья вне поддерева start пропускаются)"""
+    keep = {start}
+    for leaf in leaves:
+        if leaf not in tree.nodes:
+            raise ValueError(f"Узел {leaf!r} не найден в дереве")
+        chain = []
+        node = leaf
+        while node is not None and node not in keep:
+            chain.append(node)
+            node = tree.nodes[node]["parent"]
+        if node is not None:
+            keep.update(chain)
+    return keep
+
+
+def iter_graph(tree, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+    """
+    Обойти видимую часть дерева, не строя граф в памяти.
+    Возвращает элементы ("node", узел, данные узла) и ("edge", родитель, ребенок, операции).
+
+    subtree - показывать только поддерево этого узла (по умолчанию - все дерево);
+    max_depth - глубина показываемых узлов относительно начального узла;
+    leaves - показывать только узлы на путях к этим листьям;
+    collapse_chains - цепочки промежуточных узлов с одним видимым ребенком
+    сворачиваются в одно ребро со списком операций.
+    Обход идет в глубину, память - O(глубина + ширина видимой части).
+    """
+    start = _start_node(tree, subtree)
+    keep = None if leaves is None else _ancestors(tree, start, leaves)
+    limit = None if max_depth is None else tree.nodes[start]["depth"] + max_depth
+
+    stack = [(None, (), start)]
+    while stack:
+        parent, ops, node = stack.pop()
+        data = tree.nodes[node]
+        children = []
+        if limit is None or data["depth"] < limit:
+            children = [child for child in data["children"] if keep is None or child["node"] in keep]
+
+        if collapse_chains and parent is not None and len(children) == 1 and node not in tree.leaves:
+            child = children[0]
+            stack.append((parent, ops + (child["op"],), child["node"]))
+            continue
+
+        yield "node", node, data
+        if parent is not None:
+            yield "edge", parent, node, ops
+        for child in reversed(children):
+            stack.append((node, (child["op"],), child["node"]))
+
+
+def node_attributes(tree, node, data):
+    """Метка и атрибуты узла для Graphviz"""
+    label = f"{node}\n(depth: {data['depth']}, edges: {data['edge_count']})"
+    if node in tree.leaves:
+        return label, {"color": "green", "penwidth": "2"}
+    return label, {}
+
+
+def edge_attributes(ops):
+    """Метка и цвет ребра: одна операция или свернутая цепочка операций (по строке на операцию)"""
+    label = "\n".join(op[1] for op in ops)
+    types = {op[0] for op in ops}
+    color = EDGE_COLORS[ops[0][0]] if len(types) == 1 else "black"
+    return label, {"color": color, "fontcolor": color}
+
+
+def graph_label(tree):
+    return f"Глубина дерева: {tree.max_depth}"
+
+
+def _quote(text):
+    text = str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{text}"'
+
+
+def _attributes(attrs):
+    return " ".join(f"{key}={_quote(value)}" for key, value in attrs.items())
+
+
+def write_dot(tree, out, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+    """
+    Записать дерево в формате DOT прямо в файл по мере обхода.
+    out - путь или открытый текстовый файл. Параметры отбора узлов - как у iter_graph.
+    Возвращает количество записанных узлов.
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w", encoding="utf-8") as f:
+            return write_dot(tree, f, subtree, max_depth, leaves, collapse_chains)
+
+    out.write("digraph {\n")
+    out.write("\tnode [shape=box style=rounded]\n")
+    out.write(f"\tgraph [label={_quote(graph_label(tree))} labeljust=c labelloc=t]\n")
+    count = 0
+    for element in iter_graph(tree, subtree, max_depth, leaves, collapse_chains):
+        if element[0] == "node":
+            _, node, data = element
+            label, attrs = node_attributes(tree, node, data)
+            out.write(f"\t{_quote(node)} [{_attributes({'label': label, **attrs})}]\n")
+            count += 1
+        else:
+            _, parent, child, ops = element
+            label, attrs = edge_attributes(ops)
+            out.write(f"\t{_quote(parent)} -> {_quote(child)} [{_attributes({'label': label, **attrs})}]\n")
+    out.write("}\n")
+    return count
+
+
+def to_graphviz(tree, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+    """Граф graphviz.Digraph для дерева или его части (параметры отбора - как у iter_graph)"""
+    from graphviz import Digraph
+
+    dot = Digraph()
+    dot.attr('node', shape='box', style='rounded')
+
+    for element in iter_graph(tree, subtree, max_depth, leaves, collapse_chains):
+        if element[0] == "node":
+            _, node, data = element
+            label, attrs = node_attributes(tree, node, data)
+            dot.node(node, label, **attrs)
+        else:
+            _, parent, child, ops = element
+            label, attrs = edge_attributes(ops)
+            dot.edge(parent, child, label=label, **attrs)
+
+    # Добавляем информацию о максимальной глубине
+    dot.attr(label=graph_label(tree), labelloc="t", labeljust="c")
+
+    return dot
+
+
+def write_json(tree, out, subtree=None, max_depth=None, leaves=None, collapse_chains=False):
+    """
+    Записать дерево в JSON по мере обхода: {"root", "max_depth", "nodes": [...]},
+    узел - {"node", "name", "depth", "edge_count", "leaf", "parent", "ops"}, где
+    ops - операции ребра от родителя (несколько у свернутой цепочки).
+    out - путь или открытый текстовый файл. Возвращает количество записанных узлов.
+    """
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w", encoding="utf-8") as f:
+            return write_json(tree, f, subtree, max_depth, leaves, collapse_chains)
+
+    out.write(f'{{"root": {json.dumps(tree.root, ensure_ascii=False)}, "max_depth": {tree.max_depth}, "nodes": [')
+    count = 0
+    pending = None
+    for element in iter_graph(tree, subtree, max_depth, leaves, collapse_chains):
+        if element[0] == "node":
+            if pending is not None:
+                out.write((",\n" if count else "\n") + json.dumps(pending, ensure_ascii=False))
+                count += 1
+            _, node, data = element
+            pending = {"node": node, "name": data["name"], "depth": data["depth"], "edge_count": data["edge_count"],
+                       "leaf": node in tree.leaves, "parent": None, "ops": []}
+        else:
+            # Ребро к узлу идет сразу после самого узла
+            _, parent, _, ops = element
+            pending["parent"] = parent
+            pending["ops"] = [list(op) for op in ops]
+    if pending is not None:
+        out.write((",\n" if count else "\n") + json.dumps(pending, ensure_ascii=False))
+        count += 1
+    out.write("\n]}\n")
+    return count
+
+
+# Способы отрисовки: имя -> функция или строка "модуль:функция", импортируемая при первом вызове
+BACKENDS = {
+    "graphviz": "render:to_graphviz",
+    "dot": "render:write_dot",
+    "json": "render:write_json",
+}
+
+
+def register_backend(name, backend):
+    """Добавить способ отрисовки: функцию backend(tree, ...) или строку "модуль:функция" """
+    BACKENDS[name] = backend
+
+
+def get_backend(name):
+    """Функция отрисовки по имени (модуль загружается только сейчас)"""
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Неизвестный способ отрисовки: {name}")
+    if isinstance(backend, str):
+        module, _, function = backend.partition(":")
+        backend = BACKENDS[name] = getattr(importlib.import_module(module), function)
+    return backend
+
+
+def render(tree, backend="graphviz", *args, **options):
+    """Отрисовать или экспортировать дерево выбранным способом"""
+    return get_backend(backend)(tree, *args, **options)
@@ -0,0 +1,248 @@
+import asyncio
+import json
+
+from genetic import TreeBuilder
+
+# Сколько секунд ждать остальные запросы к тому же дереву, прежде чем оценивать пакет
+BATCH_DELAY = 0.002
+
+
+class TreeService:
+    """
+    Деревья, которые постоянно держатся в памяти, и добавление в них листьев
+    через asyncio. Запросы к одному дереву, пришедшие в течение batch_delay
+    секунд, добавляются одним пакетом (в порядке поступления) в executor,
+    чтобы оценка кандидатов не блокировала цикл событий. Пакеты и другие
+    изменения одного дерева выполняются строго по очереди.
+    Листья пакета оцениваются по одному: каждый добавленный лист меняет
+    открытые узлы и их количество ребер, а полный перебор и так оценивает
+    каждую пару (узел, лист) один раз. Пакет экономит переходы в executor
+    и захваты блокировки.
+    Параметры builder_options передаются в TreeBuilder каждого дерева.
+    """
+
+    def __init__(self, batch_delay=BATCH_DELAY, executor=None, **builder_options):
+        self.batch_delay = batch_delay
+        self.executor = executor
+        self.builder_options = builder_options
+        self.builders = {}
+        self.batches = 0
+        self._locks = {}
+        self._queues = {}
+        self._tasks = set()
+
+    def create(self, name, root=None, tree=None, **options):
+        """Создать дерево name от корня root или взять готовое дерево (например, из snapshot.load_tree)"""
+        if name in self.builders:
+            raise ValueError(f"Дерево {name!r} уже существует")
+        if tree is not None:
+            root = tree.root
+        self.builders[name] = TreeBuilder(root, tree=tree, **dict(self.builder_options, **options))
+        self._locks[name] = asyncio.Lock()
+        self._queues[name] = []
+        return self.builders[name].tree
+
+    def _builder(self, name):
+        builder = self.builders.get(name)
+        if builder is None:
+            raise KeyError(f"Дерево {name!r} не найдено")
+        return builder
+
+    async def attach(self, name, leaf):
+        """Добавить лист в дерево name, вернуть (узел, к которому он подвешен, путь)"""
+        node, path, _ = await self._attach(name, leaf)
+        return node, path
+
+    async def _attach(self, name, leaf):
+        """Как attach, но еще и глубина листа сразу после добавления"""
+        self._builder(name)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues[name]
+        queue.append((leaf, future))
+        if len(queue) == 1:
+            loop.call_later(self.batch_delay, self._schedule_flush, name)
+        return await future
+
+    def _schedule_flush(self, name):
+        # Ссылка на задачу нужна, иначе сборщик мусора может удалить ее до завершения
+        task = asyncio.ensure_future(self._flush(name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, name):
+        async with self._locks[name]:
+            batch, self._queues[name] = self._queues[name], []
+            if not batch:
+                return
+            self.batches += 1
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, _attach_batch, self.builders[name],
+                                                 [leaf for leaf, _ in batch])
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _run_locked(self, name, func, *args):
+        """Выполнить func(*args) в executor, когда с деревом name никто не работает"""
+        self._builder(name)
+        async with self._locks[name]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def remove(self, name, leaf):
+        """Удалить лист из дерева name (EvolutionTree.remove_leaf)"""
+        return await self._run_locked(name, self._builder(name).tree.remove_leaf, leaf)
+
+    async def save(self, name, path):
+        """Сохранить снимок дерева name"""
+        from snapshot import save_tree
+        await self._run_locked(name, save_tree, self._builder(name).tree, path)
+
+    async def info(self, name):
+        """Сводка по дереву name (под той же блокировкой, что и изменения дерева)"""
+        tree = self._builder(name).tree
+        async with self._locks[name]:
+            return {"root": tree.root, "nodes": len(tree.nodes), "leaves": len(tree.leaves),
+                    "max_depth": tree.max_depth}
+
+
+def _attach_batch(builder, leaves):
+    """
+    Добавить пакет листьев (в executor), вернуть (узел, путь, глубина листа)
+    для каждого; ошибки возвращаются вместо результата
+    """
+    results = []
+    nodes = builder.tree.nodes
+    for leaf in leaves:
+        try:
+            if leaf in builder.tree.leaves:
+                node, path = None, []
+            else:
+                node, path = builder.attach(leaf)
+            results.append((node, path, nodes.depth(leaf) if leaf in nodes else None))
+        except Exception as error:
+            results.append(error)
+    return results
+
+
+def _string(request, field, default=None):
+    """Строковое поле запроса (KeyError, если его нет, ValueError, если это не строка)"""
+    value = request[field] if default is None else request.get(field, default)
+    if not isinstance(value, str):
+        raise ValueError(f"Поле {field!r} должно быть строкой")
+    return value
+
+
+async def handle_request(service, request):
+    """Выполнить один запрос (словарь из JSON), вернуть словарь ответа"""
+    if not isinstance(request, dict):
+        return {"ok": False, "error": "Запрос должен быть JSON-объектом"}
+    op = request.get("op")
+    try:
+        name = _string(request, "tree", "default")
+        if op == "create":
+            service.create(name, _string(request, "root"))
+            result = await service.info(name)
+        elif op == "attach":
+            node, path, depth = await service._attach(name, _string(request, "leaf"))
+            result = {"node": node, "path": [list(step) for step in path], "exists": node is None, "depth": depth}
+        elif op == "remove":
+            result = {"removed": await service.remove(name, _string(request, "leaf"))}
+        elif op == "save":
+            await service.save(name, _string(request, "path"))
+            result = {}
+        elif op == "info":
+            result = await service.info(name)
+        else:
+            raise ValueError(f"Неизвестная операция: {op!r}")
+    except (KeyError, ValueError, TimeoutError) as error:
+        # str(KeyError) добавляет лишние кавычки вокруг сообщения
+        message = error.args[0] if isinstance(error, KeyError) and error.args else str(error)
+        response = {"ok": False, "error": str(message)}
+    else:
+        response = {"ok": True, **result}
+    if "id" in request:
+        response["id"] = request["id"]
+    return response
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Соединение с построчным JSON: каждая строка - запрос, на каждый запрос
+    приходит строка ответа. Запросы одного соединения выполняются параллельно,
+    поэтому ответы могут идти не по порядку: поле "id" запроса копируется в ответ.
+    """
+    write_lock = asyncio.Lock()
+    tasks = set()
+
+    async def respond(line):
+        try:
+            response = await handle_request(service, json.loads(line))
+        except json.JSONDecodeError as error:
+            response = {"ok": False, "error": f"Некорректный JSON: {error}"}
+        except Exception as error:
+            # На каждый запрос должен прийти ответ, иначе клиент будет ждать вечно
+            response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+        async with write_lock:
+            writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+
+    try:
+        while line := await reader.readline():
+            if line.strip():
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        writer.close()
+
+
+async def serve(service, host="127.0.0.1", port=8765, path=None):
+    """Запустить сервер на TCP-порту или на Unix-сокете path, вернуть asyncio.Server"""
+    def handler(reader, writer):
+        return handle_connection(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path=path)
+    return await asyncio.start_server(handler, host, port)
+
+
+def main(argv=None):
+    """Командная строка: запустить сервис с деревьями из корней или снимков"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сервис добавления листьев в деревья эволюции")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="слушать Unix-сокет вместо TCP-порта")
+    parser.add_argument("--tree", action="append", default=[], metavar="ИМЯ=КОРЕНЬ", help="создать дерево")
+    parser.add_argument("--load", action="append", default=[], metavar="ИМЯ=СНИМОК", help="загрузить дерево из снимка")
+    parser.add_argument("--prune", action="store_true", help="метод ветвей и границ")
+    parser.add_argument("--batch-delay", type=float, default=BATCH_DELAY)
+    args = parser.parse_args(argv)
+
+    async def run():
+        service = TreeService(batch_delay=args.batch_delay, prune=args.prune)
+        for spec in args.tree:
+            name, root = spec.split("=", 1)
+            service.create(name, root)
+        for spec in args.load:
+            from snapshot import load_tree
+            name, path = spec.split("=", 1)
+            service.create(name, tree=load_tree(path))
+        server = await serve(service, args.host, args.port, args.unix)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
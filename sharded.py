@@ -0,0 +1,111 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from genetic import _select_candidate_pruned, build_optimal_tree
+from strategies import evolution_path_length
+
+# Способы разбиения листьев на кластеры
+CLUSTER_METHODS = ("qgram", "length")
+
+
+def _grams(text, q):
+    if len(text) < q:
+        return {text}
+    return {text[i:i + q] for i in range(len(text) - q + 1)}
+
+
+def cluster_leaves(root, leaves, shards, cluster_by="qgram", qgram_size=2, seed=0):
+    """
+    Разбить листья на не более чем shards непустых кластеров.
+    "qgram" - shards случайных (зерно seed) листьев становятся центрами, каждый
+    лист попадает к центру, с которым у него больше всего общих q-грамм
+    (при равенстве - к первому). "length" - листья сортируются по длине пути
+    от корня и делятся на shards частей подряд.
+    """
+    leaves = list(dict.fromkeys(leaves))
+    if cluster_by not in CLUSTER_METHODS:
+        raise ValueError(f"Неизвестный способ кластеризации: {cluster_by}")
+    if shards <= 1 or len(leaves) <= shards:
+        return [leaves] if shards <= 1 else [[leaf] for leaf in leaves]
+
+    if cluster_by == "length":
+        ordered = sorted(leaves, key=lambda leaf: evolution_path_length(root, leaf))
+        size = -(-len(ordered) // shards)
+        return [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+    centers = [_grams(leaf, qgram_size) for leaf in random.Random(seed).sample(leaves, shards)]
+    clusters = [[] for _ in centers]
+    for leaf in leaves:
+        grams = _grams(leaf, qgram_size)
+        best = max(range(len(centers)), key=lambda index: (len(grams & centers[index]), -index))
+        clusters[best].append(leaf)
+    return [cluster for cluster in clusters if cluster]
+
+
+def _build_shard(root, leaves, options):
+    """Построить поддерево одного кластера (в процессе-обработчике)"""
+    tree = build_optimal_tree(root, leaves, **options)
+    tree.path_cache.clear()
+    tree.length_cache.clear()
+    return tree
+
+
+def merge_trees(tree, other):
+    """
+    Перенести узлы дерева other (с тем же корнем) в tree. Ребра other
+    повторяются через add_node от уже перенесенного родителя, так что
+    совпадающие узлы переиспользуются, а заполненные - заменяются клонами.
+    Если у родителя в tree уже max_edges детей, поддерево переносится к лучшему
+    открытому узлу tree по тем же правилам выбора, что и лист.
+    """
+    if other.root != tree.root:
+        raise ValueError(f"Корни деревьев не совпадают: {tree.root!r} и {other.root!r}")
+
+    mapping = {other.root: tree.root}
+    stack = [(other.root, child) for child in reversed(other.nodes[other.root]["children"])]
+    while stack:
+        parent, child = stack.pop()
+        node = child["node"]
+        name = other.nodes.name(node)
+        target = mapping[parent]
+        if tree.nodes.edge_count(target) < tree.max_edges:
+            mapping[node] = tree.add_node(target, name, child["op"], tree.nodes.depth(target) + 1)
+        else:
+            best_node, path = _select_candidate_pruned(tree, name)
+            was_leaf = name in tree.leaves
+            mapping[node] = tree.add_path_to_tree(path, name, best_node)
+            if not was_leaf:
+                # add_path_to_tree помечает конец пути как лист, а это может быть промежуточный узел
+                tree.leaves.discard(name)
+        stack.extend((node, grandchild) for grandchild in reversed(other.nodes[node]["children"]))
+
+    tree.leaves.update(other.leaves)
+    return tree
+
+
+def build_sharded(root, leaves, shards=8, workers=None, cluster_by="qgram", qgram_size=2, seed=0, **options):
+    """
+    Построение по частям для очень больших наборов листьев: листья делятся на
+    кластеры (cluster_leaves), поддерево каждого кластера строится от общего
+    корня в отдельном процессе (build_optimal_tree с options), затем поддеревья
+    сливаются под корнем, начиная с самого большого (merge_trees).
+    Дерево получается другим, чем у build_optimal_tree, но каждый кластер
+    строится за O(размер кластера^2) вместо O(всех листьев^2).
+    """
+    clusters = cluster_leaves(root, leaves, shards, cluster_by, qgram_size, seed)
+    if not clusters:
+        return build_optimal_tree(root, [], **options)
+
+    workers = min(workers or os.cpu_count() or 1, len(clusters))
+    if workers <= 1:
+        trees = [_build_shard(root, cluster, options) for cluster in clusters]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            trees = list(pool.map(_build_shard, [root] * len(clusters), clusters, [options] * len(clusters)))
+
+    trees.sort(key=lambda tree: len(tree.nodes), reverse=True)
+    tree = trees[0]
+    for other in trees[1:]:
+        merge_trees(tree, other)
+    return tree
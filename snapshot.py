@@ -0,0 +1,163 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from genetic import PATH_CACHE_SIZE, EvolutionTree
+from storage import OP_CODES, OP_TYPES
+
+MAGIC = b"EVTREE01"
+SNAPSHOT_VERSION = 1
+
+# Длина строки-заглушки: имя узла совпадает с его ключом (не клон)
+SAME_AS_KEY = 0xFFFFFFFF
+
+# Порядок секций файла после заголовка
+SECTIONS = ("keys", "names", "op_values", "leaves", "parent", "depth", "op_type")
+ARRAY_TYPES = {"parent": "i", "depth": "i", "op_type": "B"}
+
+
+def _pack_strings(strings):
+    """Таблица строк: массив длин в байтах (uint32) и склеенные байты UTF-8"""
+    lengths = array("I")
+    chunks = []
+    for text in strings:
+        if text is None:
+            lengths.append(SAME_AS_KEY)
+            continue
+        data = text.encode("utf-8")
+        lengths.append(len(data))
+        chunks.append(data)
+    return lengths.tobytes() + b"".join(chunks), len(lengths)
+
+
+def _unpack_strings(buffer, offset, count):
+    lengths = memoryview(buffer)[offset:offset + 4 * count].cast("I")
+    position = offset + 4 * count
+    strings = []
+    for length in lengths:
+        if length == SAME_AS_KEY:
+            strings.append(None)
+            continue
+        strings.append(str(buffer[position:position + length], "utf-8"))
+        position += length
+    lengths.release()
+    return strings
+
+
+def save_tree(tree, path):
+    """
+    Сохранить дерево в бинарный файл: заголовок JSON и секции с префиксом длины -
+    таблицы строк (ключи узлов, имена клонов "_N", значения операций, листья)
+    и массивы родителя, глубины и кода операции в порядке создания узлов.
+    Дети восстанавливаются в том же порядке: узел всегда присоединяется к
+    родителю в момент создания.
+    """
+    ids = {}
+    keys, names, op_values = [], [], []
+    parent, depth, op_type = array("i"), array("i"), array("B")
+    for node_id, node in enumerate(tree.nodes):
+        data = tree.nodes[node]
+        ids[node] = node_id
+        keys.append(node)
+        names.append(None if data["name"] == node else data["name"])
+        parent.append(-1 if data["parent"] is None else ids[data["parent"]])
+        depth.append(data["depth"])
+        op = data["op"]
+        op_type.append(OP_CODES[None if op is None else op[0]])
+        op_values.append("" if op is None else op[1])
+
+    sections = {
+        "keys": _pack_strings(keys),
+        "names": _pack_strings(names),
+        "op_values": _pack_strings(op_values),
+        "leaves": _pack_strings(sorted(tree.leaves)),
+        "parent": (parent.tobytes(), len(parent)),
+        "depth": (depth.tobytes(), len(depth)),
+        "op_type": (op_type.tobytes(), len(op_type)),
+    }
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "root": tree.root,
+        "max_depth": tree.max_depth,
+        "max_edges": tree.max_edges,
+        "strategy": tree.strategy.name,
+        "counts": {name: sections[name][1] for name in SECTIONS},
+    }, ensure_ascii=False).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name in SECTIONS:
+            data = sections[name][0]
+            f.write(struct.pack("<Q", len(data)))
+            f.write(data)
+
+
+def read_snapshot(path):
+    """
+    Прочитать снимок: вернуть (заголовок, секции, буфер). Числовые массивы -
+    это memoryview над отображенным в память файлом (без копирования), буфер
+    нужно закрыть после освобождения этих memoryview.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} не является снимком дерева")
+
+    offset = len(MAGIC)
+    (size,) = struct.unpack_from("<Q", buffer, offset)
+    offset += 8
+    header = json.loads(str(buffer[offset:offset + size], "utf-8"))
+    offset += size
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка: {header['version']}")
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Снимок записан на машине с другим порядком байт")
+
+    sections = {}
+    for name in SECTIONS:
+        (size,) = struct.unpack_from("<Q", buffer, offset)
+        offset += 8
+        count = header["counts"][name]
+        if name in ARRAY_TYPES:
+            sections[name] = memoryview(buffer)[offset:offset + size].cast(ARRAY_TYPES[name])
+        else:
+            sections[name] = _unpack_strings(buffer, offset, count)
+        offset += size
+    return header, sections, buffer
+
+
+def load_tree(path, node_store=None, path_cache_size=PATH_CACHE_SIZE, qgram_size=None, strategy=None):
+    """
+    Загрузить дерево из снимка. Имена узлов (в том числе клоны "_N"), глубины,
+    операции, листья и max_depth восстанавливаются как были; индексы открытых
+    узлов строятся заново. Дерево можно достроить: build_optimal_tree(root,
+    leaves, tree=дерево) добавит только листья, которых в нем еще нет.
+    strategy - стратегия поиска пути, по умолчанию та, имя которой записано в снимке.
+    """
+    header, sections, buffer = read_snapshot(path)
+    tree = EvolutionTree(header["root"], path_cache_size=path_cache_size, max_edges=header["max_edges"],
+                         node_store=node_store, strategy=strategy or header["strategy"], qgram_size=qgram_size)
+
+    keys = sections["keys"]
+    names = sections["names"]
+    op_values = sections["op_values"]
+    parent = sections["parent"]
+    depth = sections["depth"]
+    op_type = sections["op_type"]
+    for node_id in range(1, len(keys)):
+        node = keys[node_id]
+        name = names[node_id]
+        op = (OP_TYPES[op_type[node_id]], op_values[node_id])
+        tree.attach_node(keys[parent[node_id]], node, op, depth[node_id], node if name is None else name)
+
+    tree.leaves = set(sections["leaves"])
+    tree.max_depth = header["max_depth"]
+    for view in (parent, depth, op_type):
+        view.release()
+    buffer.close()
+    return tree
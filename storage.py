@@ -0,0 +1,719 @@
+import os
+import sys
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# Коды типов операций для компактного хранилища
+OP_CODES = {None: 0, "add": 1, "del": 2, "sub": 3}
+OP_TYPES = [None, "add", "del", "sub"]
+
+NODE_FIELDS = ("children", "parent", "depth", "op", "edge_count", "name")
+
+
+class DictNodeStore(dict):
+    """
+    Хранилище узлов по умолчанию: обычный словарь имя -> словарь полей узла.
+    Методы create/attach и быстрые геттеры - общий интерфейс всех хранилищ,
+    через который EvolutionTree изменяет и читает узлы.
+    """
+
+    def create(self, node, parent, depth, op, name):
+        """Создать узел без детей, вернуть его дескриптор"""
+        self[node] = {
+            "children": [],
+            "parent": parent,
+            "depth": depth,
+            "op": op,
+            "edge_count": 0,
+            "name": name
+        }
+        return node
+
+    def attach(self, parent, child, op):
+        """Добавить ребро parent -> child, вернуть новое количество ребер родителя"""
+        parent_data = self[parent]
+        parent_data["children"].append({
+            "node": child,
+            "op": op
+        })
+        parent_data["edge_count"] += 1
+        return parent_data["edge_count"]
+
+    def remove(self, node):
+        """Удалить узел без детей и ребро к нему, вернуть новое количество ребер родителя"""
+        data = self.pop(node)
+        parent_data = self[data["parent"]]
+        children = parent_data["children"]
+        for position, child in enumerate(children):
+            if child["node"] == node:
+                del children[position]
+                break
+        parent_data["edge_count"] -= 1
+        return parent_data["edge_count"]
+
+    def depth(self, node):
+        return self[node]["depth"]
+
+    def edge_count(self, node):
+        return self[node]["edge_count"]
+
+    def name(self, node):
+        return self[node]["name"]
+
+    def handle(self, node):
+        """Дескриптор узла для индексов дерева (здесь - само имя)"""
+        return node
+
+    def key(self, handle):
+        """Имя узла по дескриптору"""
+        return handle
+
+
+class NodeView(Mapping):
+    """Представление узла компактного хранилища только для чтения (как словарь узла)"""
+
+    __slots__ = ("_store", "_id")
+
+    def __init__(self, store, node_id):
+        self._store = store
+        self._id = node_id
+
+    def __getitem__(self, field):
+        store = self._store
+        node_id = self._id
+        if field == "depth":
+            return store._depth[node_id]
+        if field == "edge_count":
+            return store._edge_count[node_id]
+        if field == "name":
+            return store._name(node_id)
+        if field == "parent":
+            parent = store._parent[node_id]
+            return None if parent < 0 else store._key(parent)
+        if field == "op":
+            return store._op(node_id)
+        if field == "children":
+            return [{"node": store._key(child), "op": store._op(child)}
+                    for child in store._children(node_id)]
+        raise KeyError(field)
+
+    def __iter__(self):
+        return iter(NODE_FIELDS)
+
+    def __len__(self):
+        return len(NODE_FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CompactNodeStore(Mapping):
+    """
+    Компактное хранилище узлов: целочисленные id и параллельные массивы
+    родителя, глубины, количества ребер и кода операции. Строки не копируются:
+    у клонов "_N" поле name - общая строка с ключом исходного узла, значения
+    операций интернируются. Дети хранятся связным списком id (первый ребенок,
+    последний ребенок, следующий брат).
+    Операция ребра parent -> child совпадает с операцией узла child.
+
+    Снаружи хранилище выглядит как словарь только для чтения:
+    nodes[имя]["depth"], nodes.items() и т.д. работают как раньше.
+    Удаленные узлы остаются в массивах с глубиной -1 и пропускаются при обходе.
+    """
+
+    # Дескрипторы узлов - целые id в порядке создания (EvolutionTree берет
+    # для них genetic.CompactOpenNodeIndex)
+    integer_handles = True
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = []
+        self._names = []
+        self._parent = array("i")
+        self._depth = array("i")
+        self._edge_count = array("H")
+        self._op_type = array("B")
+        self._op_value = []
+        self._first_child = array("i")
+        self._last_child = array("i")
+        self._next_sibling = array("i")
+        self._removed = 0
+
+    def create(self, node, parent, depth, op, name):
+        """Создать узел без детей, вернуть его id"""
+        node_id = len(self._depth)
+        parent_id = -1 if parent is None else self._id(parent)
+        self._register(node_id, node, parent, op, name)
+        self._parent.append(parent_id)
+        self._depth.append(depth)
+        self._edge_count.append(0)
+        if op is None:
+            self._op_type.append(0)
+            self._op_value.append(None)
+        else:
+            self._op_type.append(OP_CODES[op[0]])
+            self._op_value.append(sys.intern(op[1]))
+        self._first_child.append(-1)
+        self._last_child.append(-1)
+        self._next_sibling.append(-1)
+        return node_id
+
+    def _register(self, node_id, node, parent, op, name):
+        """Запомнить ключ и имя нового узла"""
+        self._ids[node] = node_id
+        self._keys.append(node)
+        self._names.append(self._shared_name(node, name))
+
+    def _shared_name(self, node, name):
+        """Строка name без лишней копии: ключ самого узла или исходного узла клона"""
+        if name == node:
+            return node
+        base_id = self._ids.get(name)
+        if base_id is not None:
+            return self._keys[base_id]
+        return sys.intern(name)
+
+    def attach(self, parent, child, op):
+        """Добавить ребро parent -> child, вернуть новое количество ребер родителя"""
+        parent_id = self._id(parent)
+        child_id = self._id(child)
+        last = self._last_child[parent_id]
+        if last < 0:
+            self._first_child[parent_id] = child_id
+        else:
+            self._next_sibling[last] = child_id
+        self._last_child[parent_id] = child_id
+        self._edge_count[parent_id] += 1
+        return self._edge_count[parent_id]
+
+    def remove(self, node):
+        """Удалить узел без детей и ребро к нему, вернуть новое количество ребер родителя"""
+        node_id = self._id(node)
+        parent_id = self._parent[node_id]
+        previous = -1
+        child = self._first_child[parent_id]
+        while child != node_id:
+            previous, child = child, self._next_sibling[child]
+        if previous < 0:
+            self._first_child[parent_id] = self._next_sibling[node_id]
+        else:
+            self._next_sibling[previous] = self._next_sibling[node_id]
+        if self._last_child[parent_id] == node_id:
+            self._last_child[parent_id] = previous
+        self._edge_count[parent_id] -= 1
+
+        self._forget(node, node_id)
+        self._depth[node_id] = -1
+        self._op_value[node_id] = None
+        self._removed += 1
+        return self._edge_count[parent_id]
+
+    def _forget(self, node, node_id):
+        """Убрать ключ и имя удаленного узла"""
+        del self._ids[node]
+        self._keys[node_id] = None
+        self._names[node_id] = None
+
+    def depth(self, node):
+        return self._depth[self._id(node)]
+
+    def edge_count(self, node):
+        return self._edge_count[self._id(node)]
+
+    def name(self, node):
+        return self._name(self._id(node))
+
+    def handle(self, node):
+        return self._id(node)
+
+    def key(self, handle):
+        return self._key(handle)
+
+    def _id(self, node):
+        return self._ids[node]
+
+    def _key(self, node_id):
+        return self._keys[node_id]
+
+    def _name(self, node_id):
+        return self._names[node_id]
+
+    def _op(self, node_id):
+        op_type = self._op_type[node_id]
+        if op_type == 0:
+            return None
+        return (OP_TYPES[op_type], self._op_value[node_id])
+
+    def _children(self, node_id):
+        child = self._first_child[node_id]
+        while child >= 0:
+            yield child
+            child = self._next_sibling[child]
+
+    def __getitem__(self, node):
+        return NodeView(self, self._id(node))
+
+    def __contains__(self, node):
+        return node in self._ids
+
+    def __iter__(self):
+        if not self._removed:
+            return iter(self._keys)
+        return (key for key in self._keys if key is not None)
+
+    def __len__(self):
+        return len(self._depth) - self._removed
+
+
+# Количество недавно восстановленных меток в кэше DeltaLabelNodeStore
+LABEL_CACHE_SIZE = 4096
+
+# Сколько последних найденных id держать в словаре DeltaLabelNodeStore (потом он очищается)
+RECENT_IDS_SIZE = 1024
+
+
+def label_hash(node):
+    """Хэш имени узла, одинаковый во всех процессах (в отличие от hash() при случайном PYTHONHASHSEED)"""
+    return zlib.crc32(node.encode("utf-8"))
+
+
+def apply_operation(node, op):
+    """Применить операцию (op_type, value) к строке node так же, как add_path_to_tree"""
+    op_type, op_value = op
+    if op_type == "add":
+        return node + op_value
+    if op_type == "del":
+        return node.replace(op_value, "", 1)
+    if op_type == "sub":
+        old, new = op_value.split("→")
+        return node.replace(old, new, 1)
+    return node
+
+
+class DeltaLabelNodeStore(CompactNodeStore):
+    """
+    Компактное хранилище с дельта-кодированием меток: строка узла не хранится,
+    а восстанавливается по ссылке на родителя и операции, которая его создала.
+    Полностью хранятся только метки, которые нельзя так получить (корень и
+    листья, имя которых задано явно). Клоны "_N" хранят только номер N.
+
+    Недавно восстановленные метки держатся в LRU-кэше размера label_cache_size.
+    Узлы ищутся по label_hash имени с проверкой восстановленной строки в
+    таблице с открытой адресацией на массивах (около 12 байт на узел, таблица
+    остается верной после pickle в другой процесс), поэтому память
+    на метки растет как O(узлов), а не O(узлов x длина строки).
+    """
+
+    def __init__(self, label_cache_size=LABEL_CACHE_SIZE):
+        super().__init__()
+        self.label_cache_size = label_cache_size
+        self.label_hits = 0
+        self.label_misses = 0
+        # Хэш ключа каждого узла и таблица id + 1 (0 - пусто, -1 - удаленный узел)
+        self._hashes = array("I")
+        self._table = array("i", bytes(4 * 8))
+        self._table_used = 0
+        # Родитель нового узла ищется несколько раз подряд: последние id - в словаре
+        self._recent_ids = {}
+        self._explicit = {}
+        self._suffix = array("I")
+        self._label_cache = OrderedDict()
+
+    def _register(self, node_id, node, parent, op, name):
+        if node == name:
+            self._suffix.append(0)
+        else:
+            # Клон: имя узла - name с суффиксом "_N"
+            suffix = node[len(name) + 1:]
+            self._suffix.append(int(suffix))
+        if parent is None or op is None or apply_operation(parent, op) != name:
+            self._explicit[node_id] = name
+
+        digest = label_hash(node)
+        self._hashes.append(digest)
+        if 2 * (self._table_used + 1) > len(self._table):
+            self._rehash()
+        self._insert(node_id, digest)
+        self._remember(node_id, name)
+
+    def _insert(self, node_id, digest):
+        table = self._table
+        mask = len(table) - 1
+        slot = digest & mask
+        while table[slot] > 0:
+            slot = (slot + 1) & mask
+        if not table[slot]:
+            self._table_used += 1
+        table[slot] = node_id + 1
+
+    def _rehash(self):
+        """Перестроить таблицу: заполнение не больше четверти, удаленные узлы выбрасываются"""
+        depth = self._depth
+        live = [node_id for node_id in range(len(depth)) if depth[node_id] >= 0]
+        size = 8
+        while size < 4 * (len(live) + 1):
+            size *= 2
+        self._table = array("i", bytes(4 * size))
+        self._table_used = 0
+        for node_id in live:
+            self._insert(node_id, self._hashes[node_id])
+
+    def _slot(self, node):
+        """Позиция узла node в таблице (KeyError, если его нет)"""
+        digest = label_hash(node)
+        table = self._table
+        hashes = self._hashes
+        mask = len(table) - 1
+        slot = digest & mask
+        while True:
+            entry = table[slot]
+            if not entry:
+                raise KeyError(node)
+            if entry > 0 and hashes[entry - 1] == digest and self._key(entry - 1) == node:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _forget(self, node, node_id):
+        self._recent_ids.pop(node, None)
+        self._table[self._slot(node)] = -1
+        self._explicit.pop(node_id, None)
+        self._label_cache.pop(node_id, None)
+
+    def _remember(self, node_id, label):
+        if not self.label_cache_size:
+            return
+        self._label_cache[node_id] = label
+        if len(self._label_cache) > self.label_cache_size:
+            self._label_cache.popitem(last=False)
+
+    def _id(self, node):
+        node_id = self._recent_ids.get(node)
+        if node_id is None:
+            node_id = self._table[self._slot(node)] - 1
+            if len(self._recent_ids) >= RECENT_IDS_SIZE:
+                self._recent_ids.clear()
+            self._recent_ids[node] = node_id
+        return node_id
+
+    def _name(self, node_id):
+        label = self._label_cache.get(node_id)
+        if label is not None:
+            self._label_cache.move_to_end(node_id)
+            self.label_hits += 1
+            return label
+        self.label_misses += 1
+
+        # Поднимаемся до узла с известной меткой, затем применяем операции вниз
+        chain = []
+        current = node_id
+        while current not in self._explicit and current not in self._label_cache:
+            chain.append(current)
+            current = self._parent[current]
+        label = self._explicit.get(current)
+        if label is None:
+            label = self._label_cache[current]
+        for child in reversed(chain):
+            label = apply_operation(self._key_from_label(current, label), self._op(child))
+            self._remember(child, label)
+            current = child
+        return label
+
+    def _key_from_label(self, node_id, label):
+        suffix = self._suffix[node_id]
+        return f"{label}_{suffix}" if suffix else label
+
+    def _key(self, node_id):
+        return self._key_from_label(node_id, self._name(node_id))
+
+    def __contains__(self, node):
+        try:
+            self._id(node)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        depth = self._depth
+        for node_id in range(len(depth)):
+            if depth[node_id] >= 0:
+                yield self._key(node_id)
+
+
+def _drop_database(db, path):
+    """Закрыть соединение SqliteNodeStore и удалить его временный файл"""
+    db.close()
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+# Количество строк узлов в кэше SqliteNodeStore
+NODE_CACHE_SIZE = 100000
+
+# Сколько вытесненных из кэша измененных строк копить перед записью в базу
+WRITE_BATCH_SIZE = 1000
+
+# Поля строки узла в кэше SqliteNodeStore
+KEY, NAME, PARENT, DEPTH, OP_TYPE, OP_VALUE, EDGE_COUNT = range(7)
+
+
+class _Column:
+    """Доступ к одному полю строк по id (как к массиву компактного хранилища)"""
+
+    __slots__ = ("_store", "_field")
+
+    def __init__(self, store, field):
+        self._store = store
+        self._field = field
+
+    def __getitem__(self, node_id):
+        return self._store._row(node_id)[self._field]
+
+
+class SqliteNodeStore(Mapping):
+    """
+    Хранилище узлов в базе SQLite для деревьев, которые не помещаются в память.
+    Узлы - строки таблицы с целочисленным id; дети узла - строки с тем же
+    parent в порядке id (ребенок присоединяется при создании).
+
+    В памяти держится кэш последних использованных строк размера cache_size
+    (обратная запись: измененные строки пишутся в базу пачками при
+    вытеснении) и все узлы не глубже pin_depth - верхушка дерева, через
+    которую проходят почти все пути. Открытые узлы перебираются при каждом
+    листе, поэтому cache_size стоит брать не меньше их количества.
+    path - файл базы (по умолчанию временный, удаляется при close());
+    таблица узлов в нем создается заново.
+
+    Снаружи хранилище выглядит как CompactNodeStore, поэтому build_optimal_tree
+    и visualize работают с ним без изменений:
+    build_optimal_tree(root, leaves, node_store=SqliteNodeStore).
+    """
+
+    integer_handles = True
+
+    def __init__(self, path=None, cache_size=NODE_CACHE_SIZE, pin_depth=2):
+        import sqlite3
+        import tempfile
+
+        self._temporary = path is None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(handle)
+        self.path = path
+        self.cache_size = cache_size
+        self.pin_depth = pin_depth
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("DROP TABLE IF EXISTS nodes")
+        self._db.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY, key TEXT UNIQUE, name TEXT, parent INTEGER,"
+                         " depth INTEGER, op_type INTEGER, op_value TEXT, edge_count INTEGER)")
+        self._db.execute("CREATE INDEX nodes_parent ON nodes (parent)")
+        # Временный файл удаляется и без явного close(), когда хранилище собирает сборщик мусора
+        self._finalizer = weakref.finalize(self, _drop_database, self._db, path if self._temporary else None)
+
+        self._cache = OrderedDict()
+        self._pinned = {}
+        self._dirty = set()
+        self._pending = {}
+        self._ids = {}
+        self._evicted = False
+        self._next_id = 0
+        self._count = 0
+        self.reads = 0
+        self.writes = 0
+        self._depth = _Column(self, DEPTH)
+        self._edge_count = _Column(self, EDGE_COUNT)
+        self._parent = _Column(self, PARENT)
+
+    # Кэш строк
+
+    def _row(self, node_id):
+        row = self._pinned.get(node_id)
+        if row is not None:
+            return row
+        row = self._cache.get(node_id)
+        if row is not None:
+            self._cache.move_to_end(node_id)
+            return row
+        row = self._pending.pop(node_id, None)
+        if row is not None:
+            self._dirty.add(node_id)
+            self._cache_row(node_id, row)
+            return row
+        return self._load("id", node_id)[1]
+
+    def _load(self, column, value):
+        """Прочитать строку из базы в кэш, вернуть (id, строка)"""
+        # Вытесненные, но еще не записанные строки тоже должны находиться
+        self._write_pending()
+        self.reads += 1
+        found = self._db.execute("SELECT id, key, name, parent, depth, op_type, op_value, edge_count"
+                                 f" FROM nodes WHERE {column} = ?", (value,)).fetchone()
+        if found is None:
+            raise KeyError(value)
+        node_id, row = found[0], list(found[1:])
+        if row[NAME] is None:
+            row[NAME] = row[KEY]
+        self._cache_row(node_id, row)
+        return node_id, row
+
+    def _cache_row(self, node_id, row):
+        self._ids[row[KEY]] = node_id
+        if row[DEPTH] <= self.pin_depth:
+            self._pinned[node_id] = row
+            return
+        self._cache[node_id] = row
+        while len(self._cache) > self.cache_size:
+            old_id, old_row = self._cache.popitem(last=False)
+            del self._ids[old_row[KEY]]
+            self._evicted = True
+            if old_id in self._dirty:
+                self._dirty.discard(old_id)
+                self._pending[old_id] = old_row
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            self._write_pending()
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        self.writes += len(self._pending)
+        self._db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(node_id, row[KEY], None if row[NAME] == row[KEY] else row[NAME], row[PARENT],
+                               row[DEPTH], row[OP_TYPE], row[OP_VALUE], row[EDGE_COUNT])
+                              for node_id, row in self._pending.items()])
+        self._pending.clear()
+
+    def _write_dirty(self):
+        # Запись без commit: то же соединение видит незафиксированные строки
+        for node_id in self._dirty:
+            self._pending[node_id] = self._pinned.get(node_id) or self._cache[node_id]
+        self._dirty.clear()
+        self._write_pending()
+
+    def flush(self):
+        """Записать в базу все измененные строки (кэш при этом сохраняется)"""
+        self._write_dirty()
+        self._db.commit()
+
+    def close(self):
+        """Закрыть базу (временный файл удаляется)"""
+        if self._db is None:
+            return
+        if not self._temporary:
+            self.flush()
+        self._finalizer()
+        self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Интерфейс хранилища
+
+    def create(self, node, parent, depth, op, name):
+        """Создать узел без детей, вернуть его id"""
+        node_id = self._next_id
+        self._next_id += 1
+        parent_id = -1 if parent is None else self._id(parent)
+        op_type, op_value = (0, None) if op is None else (OP_CODES[op[0]], op[1])
+        self._cache_row(node_id, [node, name, parent_id, depth, op_type, op_value, 0])
+        self._dirty.add(node_id)
+        self._count += 1
+        return node_id
+
+    def attach(self, parent, child, op):
+        """Добавить ребро parent -> child, вернуть новое количество ребер родителя"""
+        parent_id = self._id(parent)
+        row = self._row(parent_id)
+        row[EDGE_COUNT] += 1
+        self._dirty.add(parent_id)
+        return row[EDGE_COUNT]
+
+    def remove(self, node):
+        """Удалить узел без детей, вернуть новое количество ребер родителя"""
+        # Сначала все чтения: загрузка родителя может вытеснить строку самого узла
+        node_id = self._id(node)
+        parent_id = self._row(node_id)[PARENT]
+        parent_row = self._row(parent_id)
+
+        parent_row[EDGE_COUNT] -= 1
+        self._dirty.add(parent_id)
+        self._cache.pop(node_id, None)
+        self._pinned.pop(node_id, None)
+        self._pending.pop(node_id, None)
+        self._dirty.discard(node_id)
+        self._ids.pop(node, None)
+        self._write_pending()
+        self._db.execute("DELETE FROM nodes WHERE id = ?", (node_id,))
+        self._count -= 1
+        return parent_row[EDGE_COUNT]
+
+    def depth(self, node):
+        return self._row(self._id(node))[DEPTH]
+
+    def edge_count(self, node):
+        return self._row(self._id(node))[EDGE_COUNT]
+
+    def name(self, node):
+        return self._row(self._id(node))[NAME]
+
+    def handle(self, node):
+        return self._id(node)
+
+    def key(self, handle):
+        return self._row(handle)[KEY]
+
+    def _id(self, node):
+        # В _ids - ключи всех строк в памяти, остальные ищутся в базе
+        node_id = self._ids.get(node)
+        if node_id is None:
+            if not self._evicted:
+                raise KeyError(node)
+            node_id = self._load("key", node)[0]
+        return node_id
+
+    def _key(self, node_id):
+        return self._row(node_id)[KEY]
+
+    def _name(self, node_id):
+        return self._row(node_id)[NAME]
+
+    def _op(self, node_id):
+        row = self._row(node_id)
+        if row[OP_TYPE] == 0:
+            return None
+        return (OP_TYPES[row[OP_TYPE]], row[OP_VALUE])
+
+    def _children(self, node_id):
+        self._write_dirty()
+        rows = self._db.execute("SELECT id FROM nodes WHERE parent = ? ORDER BY id", (node_id,)).fetchall()
+        return [child_id for child_id, in rows]
+
+    def __getitem__(self, node):
+        return NodeView(self, self._id(node))
+
+    def __contains__(self, node):
+        try:
+            self._id(node)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        self.flush()
+        last = -1
+        while True:
+            rows = self._db.execute("SELECT id, key FROM nodes WHERE id > ? ORDER BY id LIMIT ?",
+                                    (last, WRITE_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for last, key in rows:
+                yield key
+
+    def __len__(self):
+        return self._count
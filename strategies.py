@@ -0,0 +1,363 @@
+from collections import Counter
+
+
+def find_evolution_path(w1, w2):
+    """
+    Находит максимальную общую последовательность символов, где позиции в w2
+    не раньше, чем соответствующие позиции в w1.
+    Возвращает список операций в формате [('op_type', value), ...]
+    """
+    w1 = str(w1)
+    w2 = str(w2)
+    n1, n2 = len(w1), len(w2)
+    
+    # Находим максимальную общую подпоследовательность
+    common = []
+    last = -1
+    list_ind_w1 = []
+    list_ind_w2 = []
+    
+    for i in range(n1):
+        if last == -1:
+            for j in range(min(i+1, n2)):
+                if w1[i] == w2[j]:
+                    list_ind_w1.append(i)
+                    list_ind_w2.append(j)
+                    last = j
+                    break
+        else:
+            for j in range(last+1, min(last + i - list_ind_w1[-1] + 1, n2)):
+                if w1[i] == w2[j]:
+                    list_ind_w1.append(i)
+                    list_ind_w2.append(j)
+                    last = j
+                    break
+    
+    # Строим операции на основе найденной общей подпоследовательности
+    operations = []
+    current_w2_pos = 0
+    current_w1_pos = 0
+    
+    # Обрабатываем символы до первой общей позиции
+    for i in range(len(list_ind_w2)):
+        if i == 0:
+            # Символы перед первым общим символом
+            for j in range(list_ind_w2[0]):
+                if current_w1_pos < n1:
+                    operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
+                    current_w1_pos += 1
+                else:
+                    operations.append(('add', w2[j]))
+                current_w2_pos = j + 1
+        
+        # Добавляем общий символ (не добавляем операцию для совпадений)
+        if current_w1_pos < list_ind_w1[i]:
+            # Удаляем лишние символы из w1
+            for k in range(current_w1_pos, list_ind_w1[i]):
+                operations.append(('del', w1[k]))
+        
+        current_w1_pos = list_ind_w1[i] + 1
+        current_w2_pos = list_ind_w2[i] + 1
+        
+        # Обрабатываем символы между общими символами
+        if i < len(list_ind_w2) - 1:
+            next_w2_pos = list_ind_w2[i+1]
+            for j in range(current_w2_pos, next_w2_pos):
+                if current_w1_pos < n1:
+                    operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
+                    current_w1_pos += 1
+                else:
+                    operations.append(('add', w2[j]))
+                current_w2_pos = j + 1
+    
+    # Обрабатываем символы после последней общей позиции
+    # Оставшиеся символы в w2
+    for j in range(current_w2_pos, n2):
+        if current_w1_pos < n1:
+            operations.append(('sub', f"{w1[current_w1_pos]}→{w2[j]}"))
+            current_w1_pos += 1
+        else:
+            operations.append(('add', w2[j]))
+    
+    # Оставшиеся символы в w1 (удаления)
+    for k in range(current_w1_pos, n1):
+        operations.append(('del', w1[k]))
+    
+    return group_operations(operations)
+
+
+def group_operations(operations):
+    """Объединить подряд идущие операции add и del в одну операцию"""
+    # Оптимизация пути (группировка последовательных операций одного типа)
+    optimized_path = []
+    i = 0
+    
+    while i < len(operations):
+        op_type, value = operations[i]
+        
+        if op_type == 'del':
+            # Группируем последовательные удаления
+            delete_chars = [value]
+            j = i + 1
+            while j < len(operations) and operations[j][0] == 'del':
+                delete_chars.append(operations[j][1])
+                j += 1
+            
+            if len(delete_chars) > 1:
+                optimized_path.append(('del', ''.join(delete_chars)))
+                i = j
+            else:
+                optimized_path.append(('del', value))
+                i += 1
+        
+        elif op_type == 'add':
+            # Группируем последовательные добавления
+            add_chars = [value]
+            j = i + 1
+            while j < len(operations) and operations[j][0] == 'add':
+                add_chars.append(operations[j][1])
+                j += 1
+            
+            if len(add_chars) > 1:
+                optimized_path.append(('add', ''.join(add_chars)))
+                i = j
+            else:
+                optimized_path.append(('add', value))
+                i += 1
+        
+        else:  # sub
+            optimized_path.append(('sub', value))
+            i += 1
+    
+    return optimized_path
+
+
+def evolution_path_length(w1, w2):
+    """
+    Длина пути len(find_evolution_path(w1, w2)) без построения списка операций.
+    
+    Повторяет тот же жадный поиск общих символов, но вместо операций считает
+    только их количество: замены считаются по одной, а подряд идущие удаления
+    и добавления (которые find_evolution_path группирует) - одной операцией.
+    """
+    w1 = str(w1)
+    w2 = str(w2)
+    n1, n2 = len(w1), len(w2)
+    
+    length = 0
+    after_del = False  # Последняя операция - удаление (следующее удаление к ней приклеится)
+    last_w1 = -1
+    last_w2 = -1
+    
+    for i in range(n1):
+        if last_w2 == -1:
+            j = w2.find(w1[i], 0, min(i + 1, n2))
+        else:
+            j = w2.find(w1[i], last_w2 + 1, min(last_w2 + i - last_w1 + 1, n2))
+        if j == -1:
+            continue
+        
+        # Между общими символами: сначала замены, затем удаление лишних символов w1
+        gap_w2 = j - last_w2 - 1
+        gap_w1 = i - last_w1 - 1
+        if gap_w2:
+            length += gap_w2
+            after_del = False
+        if gap_w1 > gap_w2 and not after_del:
+            length += 1
+            after_del = True
+        last_w1, last_w2 = i, j
+    
+    # Хвосты после последнего общего символа
+    tail_w2 = n2 - last_w2 - 1
+    tail_w1 = n1 - last_w1 - 1
+    subs = min(tail_w1, tail_w2)
+    if subs:
+        length += subs
+        after_del = False
+    if tail_w2 > tail_w1:
+        length += 1
+    elif tail_w1 > tail_w2 and not after_del:
+        length += 1
+    
+    return length
+
+
+def path_length_lower_bound(w1, w2, w2_counts=None):
+    """
+    Дешевая нижняя оценка len(find_evolution_path(w1, w2)).
+    
+    Разница длин строк оценкой не является: подряд идущие add и del
+    группируются в одну операцию. Оценка строится так: если в пути нет
+    добавлений, то каждый символ w2, которого не хватает в мультимножестве
+    символов w1, дает отдельную операцию sub, а при n1 > n2 нужна еще
+    операция del. Если добавления есть, то это минимум одна операция add
+    и, при n1 >= n2, одна операция del.
+    """
+    if w1 == w2:
+        return 0
+    n1, n2 = len(w1), len(w2)
+    if n1 < n2:
+        return 1
+    
+    if w2_counts is None:
+        w2_counts = Counter(w2)
+    missing = sum((w2_counts - Counter(w1)).values())
+    if n1 > n2:
+        return min(missing + 1, 2)
+    return max(1, min(missing, 2))
+
+
+def _gap_operations(w1, w2, i1, i2, j1, j2):
+    """
+    Операции для промежутка между общими символами: w1[i1:i2] -> w2[j1:j2].
+    Сначала замены, затем удаление лишних символов w1 или добавление лишних символов w2.
+    """
+    operations = []
+    subs = min(i2 - i1, j2 - j1)
+    for k in range(subs):
+        operations.append(('sub', f"{w1[i1 + k]}→{w2[j1 + k]}"))
+    for k in range(i1 + subs, i2):
+        operations.append(('del', w1[k]))
+    for k in range(j1 + subs, j2):
+        operations.append(('add', w2[k]))
+    return operations
+
+
+class PathStrategy:
+    """
+    Стратегия поиска пути эволюции. Путь - список операций
+    [('op_type', value), ...] с типами add, del и sub, как у find_evolution_path.
+    """
+
+    name = None
+
+    def path(self, w1, w2):
+        raise NotImplementedError
+
+    def length(self, w1, w2):
+        """Длина пути (подклассы могут считать ее без построения операций)"""
+        return len(self.path(w1, w2))
+
+    def lower_bound(self, w1, w2, w2_counts=None):
+        """Нижняя оценка длины пути для метода ветвей и границ"""
+        return 0 if w1 == w2 else 1
+
+
+class GreedyPathStrategy(PathStrategy):
+    """Жадный поиск общих символов (алгоритм по умолчанию)"""
+
+    name = "greedy"
+
+    def path(self, w1, w2):
+        return find_evolution_path(w1, w2)
+
+    def length(self, w1, w2):
+        return evolution_path_length(w1, w2)
+
+    def lower_bound(self, w1, w2, w2_counts=None):
+        return path_length_lower_bound(w1, w2, w2_counts)
+
+
+class BitParallelPathStrategy(PathStrategy):
+    """
+    Путь по наибольшей общей подпоследовательности (LCS), которая считается
+    бит-параллельным алгоритмом (Allison-Dix / Hyyrö) на длинных целых Python:
+    одна строка таблицы LCS - одно число из len(w1) бит, поэтому построение
+    таблицы стоит O(len(w2)) операций над числами вместо O(len(w1) * len(w2))
+    сравнений символов.
+
+    Промежутки между общими символами превращаются в операции того же формата,
+    что у жадного алгоритма: замены, затем удаления или добавления; подряд
+    идущие add и del группируются.
+    """
+
+    name = "bitparallel"
+
+    def _rows(self, w1, w2):
+        """Битовые векторы V_j для j = 0..len(w2): бит i равен 1, если w1[i] не вошел в LCS префиксов"""
+        masks = {}
+        for i, char in enumerate(w1):
+            masks[char] = masks.get(char, 0) | (1 << i)
+        full = (1 << len(w1)) - 1
+        vector = full
+        rows = [vector]
+        for char in w2:
+            matched = vector & masks.get(char, 0)
+            vector = ((vector + matched) | (vector - matched)) & full
+            rows.append(vector)
+        return rows
+
+    def _matches(self, w1, w2):
+        """Пары индексов (i, j) общих символов по возрастанию"""
+        rows = self._rows(w1, w2)
+
+        def lcs(i, j):
+            # Длина LCS для w1[:i] и w2[:j] - количество нулевых бит среди первых i
+            return i - (rows[j] & ((1 << i) - 1)).bit_count()
+
+        matches = []
+        i, j = len(w1), len(w2)
+        while i > 0 and j > 0:
+            current = lcs(i, j)
+            if current == 0:
+                break
+            if (rows[j] >> (i - 1)) & 1:
+                # w1[i-1] не входит в LCS
+                i -= 1
+            elif w1[i - 1] == w2[j - 1] and lcs(i - 1, j - 1) == current - 1:
+                matches.append((i - 1, j - 1))
+                i -= 1
+                j -= 1
+            else:
+                j -= 1
+        matches.reverse()
+        return matches
+
+    def _gaps(self, w1, w2):
+        """Промежутки (i1, i2, j1, j2) между общими символами, включая хвосты"""
+        last_w1 = last_w2 = -1
+        for i, j in self._matches(w1, w2):
+            yield last_w1 + 1, i, last_w2 + 1, j
+            last_w1, last_w2 = i, j
+        yield last_w1 + 1, len(w1), last_w2 + 1, len(w2)
+
+    def path(self, w1, w2):
+        w1 = str(w1)
+        w2 = str(w2)
+        operations = []
+        for i1, i2, j1, j2 in self._gaps(w1, w2):
+            operations.extend(_gap_operations(w1, w2, i1, i2, j1, j2))
+        return group_operations(operations)
+
+    def length(self, w1, w2):
+        w1 = str(w1)
+        w2 = str(w2)
+        length = 0
+        last_op = None
+        for i1, i2, j1, j2 in self._gaps(w1, w2):
+            subs = min(i2 - i1, j2 - j1)
+            if subs:
+                length += subs
+                last_op = 'sub'
+            for op_type, count in (('del', i2 - i1 - subs), ('add', j2 - j1 - subs)):
+                if count:
+                    if last_op != op_type:
+                        length += 1
+                    last_op = op_type
+        return length
+
+
+STRATEGIES = {
+    GreedyPathStrategy.name: GreedyPathStrategy,
+    BitParallelPathStrategy.name: BitParallelPathStrategy,
+}
+
+
+def get_strategy(strategy=None):
+    """Стратегия по имени ("greedy", "bitparallel"), экземпляру или None (жадная)"""
+    if strategy is None:
+        return GreedyPathStrategy()
+    if isinstance(strategy, str):
+        return STRATEGIES[strategy]()
+    return strategy
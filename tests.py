@@ -1,5 +1,12 @@
 import unittest
-from genetic import EvolutionTree,  build_optimal_tree
+from unittest import mock
+import genetic
+from genetic import EvolutionTree,  build_optimal_tree, TreeBuilder
+from strategies import path_length_lower_bound, evolution_path_length
+
+# Корень и листья, на которых многие тесты сравнивают разные способы построения
+ROOT = "abxcd"
+LEAVES = ("cbxd", "bxd", "dc", "ch", "kl", "mnabxc", "abl", "lbxcdp")
 
 class TestEvolutionTree(unittest.TestCase):
     
@@ -38,6 +45,31 @@ class TestEvolutionTree(unittest.TestCase):
         self.assertEqual(self.tree.nodes["child1"]["depth"], 1)
     
 
+    def test_clone_registry(self):
+        """Тест выбора и создания клонов "_N" у заполненных узлов"""
+        op = ("add", "x")
+        tree = self.tree
+        tree.add_node("root", "x", op, 1)
+        for child in "abc":
+            tree.add_node("x", child, op, 2)
+        
+        # Узел заполнен: создается клон, пока у него есть место, он переиспользуется
+        self.assertEqual(tree.add_node("root", "x", op, 1), "x_1")
+        self.assertEqual(tree.nodes["x_1"]["name"], "x")
+        self.assertEqual(tree.add_node("root", "x", op, 1), "x_1")
+        
+        # Узел, имя которого само оканчивается на "_2", занимает номер 2;
+        # когда он заполнен, берется клон x_1 со свободным местом, а не новый x_3
+        tree.attach_node("root", "x_2", op, 1)
+        for child in "def":
+            tree.add_node("x_2", child, op, 2)
+        self.assertEqual(tree.add_node("root", "x", op, 1), "x_1")
+        
+        for child in "ghi":
+            tree.add_node("x_1", child, op, 2)
+        self.assertEqual(tree.add_node("root", "x", op, 1), "x_3")
+        self.assertEqual(tree.nodes["x_3"]["name"], "x")
+    
     def test_get_available_nodes(self):
         """Тест получения доступных узлов"""
         available = self.tree.get_available_nodes()
@@ -49,6 +81,19 @@ class TestEvolutionTree(unittest.TestCase):
         available = self.tree.get_available_nodes()
         self.assertEqual(len(available), 2)  # root и child
     
+    def test_open_nodes_index(self):
+        """Тест индекса открытых узлов: заполненный узел пропадает из индекса"""
+        for name in ("a", "b", "c"):
+            self.tree.add_node("root", name, ("add", name), 1)
+        available = [node for node, _, _ in self.tree.get_available_nodes()]
+        self.assertEqual(available, ["a", "b", "c"])
+        self.assertNotIn("root", self.tree.open_nodes)
+        self.assertEqual(self.tree.open_nodes.bucket(1, 0), ["a", "b", "c"])
+        
+        # Запрос с большим лимитом возвращает и заполненные узлы
+        available = self.tree.get_available_nodes(max_edges=4)
+        self.assertEqual(available[0], ("root", 0, 3))
+    
     def test_add_path_to_tree(self):
         """Тест добавления пути в дерево"""
         path = [("add", "a"), ("add", "b")]
@@ -70,6 +115,602 @@ class TestEvolutionTree(unittest.TestCase):
         for leaf in leaves:
             self.assertIn(leaf, tree.leaves)
     
+    def test_path_cache(self):
+        """Тест кэша путей: повторный запрос берется из кэша"""
+        path = self.tree.find_evolution_path("abc", "axc")
+        self.assertEqual(self.tree.path_cache.misses, 1)
+        path_again = self.tree.find_evolution_path("abc", "axc")
+        self.assertEqual(path_again, path)
+        self.assertEqual(self.tree.path_cache.hits, 1)
+        
+        # Изменение возвращенного списка не портит кэш
+        path_again.append(("add", "z"))
+        self.assertEqual(self.tree.find_evolution_path("abc", "axc"), [("sub", "b→x")])
+    
+    def test_path_cache_eviction_and_disable(self):
+        """Тест ограничения размера кэша и его отключения"""
+        tree = EvolutionTree("root", path_cache_size=2)
+        tree.find_evolution_path("a", "b")
+        tree.find_evolution_path("a", "c")
+        tree.find_evolution_path("a", "d")
+        self.assertEqual(len(tree.path_cache), 2)
+        
+        tree = EvolutionTree("root", path_cache_size=0)
+        tree.find_evolution_path("a", "b")
+        tree.find_evolution_path("a", "b")
+        self.assertEqual(len(tree.path_cache), 0)
+        self.assertEqual(tree.path_cache.hits, 0)
+    
+    def test_path_length_lower_bound(self):
+        """Тест нижней оценки длины пути: не превышает настоящую длину"""
+        words = ["", "a", "ab", "ba", "abc", "axc", "abcd", "cab", "aabb", "root", "rooot", "abxcd", "lbxcdp"]
+        for w1 in words:
+            for w2 in words:
+                bound = path_length_lower_bound(w1, w2)
+                self.assertLessEqual(bound, len(self.tree.find_evolution_path(w1, w2)), (w1, w2))
+    
+    def test_evolution_path_length(self):
+        """Тест длины пути без построения операций"""
+        words = ["", "a", "ab", "ba", "abc", "axc", "abcd", "cab", "aabb", "root", "rooot", "abxcd", "lbxcdp", "mnabxc"]
+        for w1 in words:
+            for w2 in words:
+                expected = len(self.tree.find_evolution_path(w1, w2))
+                self.assertEqual(evolution_path_length(w1, w2), expected, (w1, w2))
+                self.assertEqual(self.tree.path_length(w1, w2), expected, (w1, w2))
+    
+    def test_build_optimal_tree_prune(self):
+        """Тест метода ветвей и границ: дерево совпадает с полным перебором"""
+        tree = build_optimal_tree(ROOT, LEAVES)
+        pruned = build_optimal_tree(ROOT, LEAVES, prune=True)
+        self.assertEqual(list(pruned.nodes), list(tree.nodes))
+        self.assertEqual(pruned.nodes, tree.nodes)
+        self.assertEqual(pruned.max_depth, tree.max_depth)
+    
+    def test_build_optimal_tree_workers(self):
+        """Тест параллельной оценки кандидатов: дерево совпадает с последовательным"""
+        tree = build_optimal_tree(ROOT, LEAVES)
+        with mock.patch.object(genetic, "PARALLEL_MIN_CHUNK", 1):
+            parallel = build_optimal_tree(ROOT, LEAVES, workers=2)
+        self.assertEqual(list(parallel.nodes), list(tree.nodes))
+        self.assertEqual(parallel.nodes, tree.nodes)
+    
+    def test_batch_path_lengths(self):
+        """Тест пакетной (NumPy) оценки длин путей: совпадает со скалярной"""
+        from vectorized import batch_path_lengths
+        names = ["", "a", "ab", "ba", "abc", "axc", "abcd", "cab", "aabb", "root", "abxcd", "lbxcdp", "путь"]
+        for leaf in names:
+            lengths = batch_path_lengths(leaf, names)
+            self.assertEqual(list(lengths), [evolution_path_length(name, leaf) for name in names])
+    
+    def test_build_optimal_tree_vectorized(self):
+        """Тест векторной оценки кандидатов: дерево совпадает с обычным"""
+        tree = build_optimal_tree(ROOT, LEAVES)
+        fast = build_optimal_tree(ROOT, LEAVES, vectorized=True)
+        self.assertEqual(list(fast.nodes), list(tree.nodes))
+        self.assertEqual(fast.nodes, tree.nodes)
+    
+    def test_compact_node_store(self):
+        """Тест компактного хранилища узлов: дерево и доступ к полям как у словаря"""
+        from storage import CompactNodeStore
+        tree = build_optimal_tree(ROOT, LEAVES)
+        compact = build_optimal_tree(ROOT, LEAVES, node_store=CompactNodeStore)
+        self.assertIsInstance(compact.nodes, CompactNodeStore)
+        self.assertEqual(list(compact.nodes), list(tree.nodes))
+        for node, data in tree.nodes.items():
+            self.assertEqual(dict(compact.nodes[node]), data)
+        self.assertEqual(compact.nodes["abxcd"]["depth"], 0)
+        self.assertIsNotNone(compact.visualize())
+        
+        # Индекс открытых узлов на массивах дает те же кандидаты в том же порядке
+        self.assertIsInstance(compact.open_nodes, genetic.CompactOpenNodeIndex)
+        self.assertEqual(compact.get_available_nodes(), tree.get_available_nodes())
+        for depth in tree.open_nodes.depths():
+            self.assertEqual(sorted((compact.nodes.key(node), edges) for node, edges, _ in compact.open_nodes.at_depth(depth)),
+                             sorted((node, edges) for node, edges, _ in tree.open_nodes.at_depth(depth)))
+    
+    def test_delta_label_node_store(self):
+        """Тест дельта-кодирования меток: имена восстанавливаются по родителю и операции"""
+        from functools import partial
+        from storage import DeltaLabelNodeStore
+        tree = build_optimal_tree(ROOT, LEAVES)
+        delta = build_optimal_tree(ROOT, LEAVES, node_store=partial(DeltaLabelNodeStore, label_cache_size=2))
+        self.assertEqual(list(delta.nodes), list(tree.nodes))
+        for node, data in tree.nodes.items():
+            self.assertIn(node, delta.nodes)
+            self.assertEqual(dict(delta.nodes[node]), data)
+        self.assertNotIn("missing", delta.nodes)
+        self.assertGreater(delta.nodes.label_misses, 0)
+        
+        # Дерево после pickle находит свои узлы в процессе с другой солью hash()
+        import os
+        import pickle
+        import subprocess
+        import sys
+        script = ("import pickle, sys; tree = pickle.load(sys.stdin.buffer); "
+                  "tree.attach_leaf('abxdd'); print(all(node in tree.nodes for node in tree.leaves))")
+        env = dict(os.environ, PYTHONHASHSEED="12345")
+        result = subprocess.run([sys.executable, "-c", script], input=pickle.dumps(delta), capture_output=True,
+                                env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        self.assertEqual(result.stdout.strip(), b"True")
+    
+    def test_sqlite_node_store(self):
+        """Тест хранилища в SQLite: маленький кэш вытесняет строки в базу, дерево то же"""
+        import gc
+        import io
+        import os
+        import tempfile
+        from functools import partial
+        from storage import SqliteNodeStore
+        tree = build_optimal_tree(ROOT, LEAVES)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "nodes.sqlite")
+            disk = build_optimal_tree(ROOT, LEAVES, node_store=partial(SqliteNodeStore, path, cache_size=4, pin_depth=1))
+            self.assertGreater(disk.nodes.writes, 0)
+            self.assertEqual(list(disk.nodes), list(tree.nodes))
+            for node, data in tree.nodes.items():
+                self.assertEqual(dict(disk.nodes[node]), data)
+            self.assertNotIn("missing", disk.nodes)
+            self.assertGreater(disk.write_dot(io.StringIO()), 0)
+            self.assertIsNotNone(disk.visualize())
+            
+            disk.remove_leaf("kl")
+            tree.remove_leaf("kl")
+            self.assertEqual(len(disk.nodes), len(tree.nodes))
+            disk.nodes.close()
+            self.assertTrue(os.path.exists(path))
+
+        # Кэш из одной строки: загрузка родителя вытесняет сам удаляемый лист
+        disk = build_optimal_tree(ROOT, LEAVES, node_store=partial(SqliteNodeStore, cache_size=1, pin_depth=0))
+        parent = disk.nodes["kl"]["parent"]
+        edge_count = disk.nodes[parent]["edge_count"]
+        disk.remove_leaf("kl")
+        self.assertNotIn("kl", disk.nodes)
+        self.assertEqual(len(disk.nodes), len(tree.nodes))
+        if parent in disk.nodes:
+            self.assertEqual(disk.nodes[parent]["edge_count"], edge_count - 1)
+
+        # Временный файл удаляется и без явного close()
+        temporary = disk.nodes.path
+        del disk
+        gc.collect()
+        self.assertFalse(os.path.exists(temporary))
+
+    def test_bitparallel_strategy(self):
+        """Тест бит-параллельной стратегии: путь по LCS в формате add/del/sub"""
+        from strategies import BitParallelPathStrategy
+        strategy = BitParallelPathStrategy()
+        self.assertEqual(strategy.path("abc", "abcd"), [("add", "d")])
+        self.assertEqual(strategy.path("abcd", "abc"), [("del", "d")])
+        self.assertEqual(strategy.path("abc", "axc"), [("sub", "b→x")])
+        self.assertEqual(strategy.path("abxcd", "mnabxc"), [("add", "mn"), ("del", "d")])
+        
+        words = ["", "a", "ab", "ba", "abc", "axc", "abcd", "cab", "aabb", "root", "abxcd", "lbxcdp"]
+        for w1 in words:
+            for w2 in words:
+                self.assertEqual(strategy.length(w1, w2), len(strategy.path(w1, w2)))
+                self.assertLessEqual(strategy.lower_bound(w1, w2), strategy.length(w1, w2))
+    
+    def test_build_optimal_tree_strategy(self):
+        """Тест построения дерева с другой стратегией поиска пути"""
+        tree = build_optimal_tree(ROOT, LEAVES, strategy="bitparallel")
+        self.assertEqual(tree.strategy.name, "bitparallel")
+        self.assertEqual(tree.leaves, set(LEAVES))
+        pruned = build_optimal_tree(ROOT, LEAVES, strategy="bitparallel", prune=True)
+        self.assertEqual(pruned.nodes, tree.nodes)
+        with self.assertRaises(ValueError):
+            build_optimal_tree(ROOT, LEAVES, strategy="bitparallel", vectorized=True)
+    
+    def test_qgram_shortlist(self):
+        """Тест индекса q-грамм и построения с коротким списком кандидатов"""
+        tree = EvolutionTree("root", qgram_size=2)
+        tree.add_node("root", "abcd", ("sub", "r→a"), 1)
+        tree.add_node("root", "xyzw", ("sub", "r→x"), 1)
+        self.assertEqual(tree.qgram_index.top("abce", 1), ["abcd"])
+        tree.add_node("root", "ro", ("del", "ot"), 1)
+        # Заполненный корень пропадает из индекса
+        self.assertNotIn("root", tree.qgram_index.top("root", 10))
+        
+        exact = build_optimal_tree(ROOT, LEAVES)
+        approximate = build_optimal_tree(ROOT, LEAVES, shortlist=2)
+        self.assertEqual(approximate.leaves, set(LEAVES))
+        fallback = build_optimal_tree(ROOT, LEAVES, shortlist=2, exact_fallback=True)
+        self.assertEqual(fallback.nodes, exact.nodes)
+    
+    def test_tree_builder(self):
+        """Тест инкрементального построения дерева из итератора листьев"""
+        
+        # Окно на все листья дает то же дерево, что и build_optimal_tree
+        builder = TreeBuilder(ROOT, window=len(LEAVES))
+        builder.extend(iter(LEAVES))
+        self.assertEqual(builder.tree.nodes, build_optimal_tree(ROOT, LEAVES).nodes)
+        
+        # Потоковый режим: дерево доступно после каждого листа
+        builder = TreeBuilder(ROOT)
+        for count, leaf in enumerate(LEAVES, 1):
+            builder.add(leaf)
+            self.assertEqual(len(builder.tree.leaves), count)
+            self.assertIn(leaf, builder.tree.nodes)
+        
+        # Маленькое окно: листья ждут, пока окно не заполнится
+        builder = TreeBuilder(ROOT, window=3)
+        builder.extend(LEAVES[:4])
+        self.assertEqual(builder.pending, 1)
+        tree = builder.close()
+        self.assertEqual(tree.leaves, set(LEAVES[:4]))
+    
+    def test_snapshot(self):
+        """Тест сохранения и загрузки дерева и достройки загруженного дерева"""
+        import os
+        import tempfile
+        from snapshot import save_tree, load_tree
+        from storage import CompactNodeStore, DeltaLabelNodeStore
+        
+        leaves = [*LEAVES, "bxd_1"]
+        full = build_optimal_tree(ROOT, leaves)
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tree.snap")
+            save_tree(full, path)
+            for node_store in (None, CompactNodeStore, DeltaLabelNodeStore):
+                loaded = load_tree(path, node_store=node_store)
+                self.assertIsInstance(loaded.nodes, node_store or dict)
+                self.assertEqual({node: dict(data) for node, data in loaded.nodes.items()},
+                                 {node: dict(data) for node, data in full.nodes.items()})
+                self.assertEqual(loaded.leaves, full.leaves)
+                self.assertEqual(loaded.max_depth, full.max_depth)
+                self.assertEqual(loaded.get_available_nodes(), full.get_available_nodes())
+            
+            # Достройка из снимка дает то же дерево, что и построение целиком
+            builder = TreeBuilder(ROOT, checkpoint_path=path, checkpoint_every=4)
+            builder.extend(leaves[:5])
+            partial = load_tree(path)
+            self.assertEqual(partial.leaves, set(leaves[:4]))
+            resumed = TreeBuilder(ROOT, tree=partial)
+            resumed.extend(leaves)
+            streamed = TreeBuilder(ROOT)
+            streamed.extend(leaves)
+            self.assertEqual(resumed.tree.nodes, streamed.tree.nodes)
+            
+            with self.assertRaises(ValueError):
+                TreeBuilder("abc", tree=partial)
+    
+    def test_build_stats(self):
+        """Тест счетчиков построения и вызовов progress"""
+        calls = []
+        tree = build_optimal_tree(ROOT, LEAVES, stats=True,
+                                  progress=lambda *args: calls.append(args))
+        self.assertEqual(tree.nodes, build_optimal_tree(ROOT, LEAVES).nodes)
+        
+        stats = tree.stats.as_dict()
+        counters = stats["counters"]
+        self.assertEqual(counters["leaves"], len(LEAVES))
+        self.assertEqual(counters["nodes_created"], len(tree.nodes) - 1)
+        self.assertEqual(counters["clones_created"], sum(data["name"] != node for node, data in tree.nodes.items()))
+        self.assertGreaterEqual(counters["candidates"], len(LEAVES))
+        self.assertEqual(stats["candidates_per_leaf"]["max"], tree.stats.max_candidates)
+        self.assertTrue({"sort", "scan", "score", "attach"} <= set(stats["timings"]))
+        # Длины путей от корня при сортировке не считаются оценкой кандидатов
+        self.assertEqual(counters["scored"], counters["candidates"])
+        
+        self.assertEqual([call[:2] for call in calls], [(i, len(LEAVES)) for i in range(1, len(LEAVES) + 1)])
+        self.assertEqual(calls[-1][3], 0)
+        
+        # Без stats счетчики не собираются
+        self.assertIsNone(build_optimal_tree(ROOT, LEAVES).stats)
+    
+    def test_build_multistart(self):
+        """Тест мультистарта: лучшее из нескольких построений и ограничение по времени"""
+        leaves = [*LEAVES, "abxc", "bxcd"]
+        
+        # Один запуск совпадает с обычным построением
+        single = genetic.build_multistart(ROOT, leaves, starts=1, workers=1)
+        self.assertEqual(single.nodes, build_optimal_tree(ROOT, leaves).nodes)
+        
+        trees = [genetic.build_multistart(ROOT, leaves, starts=4, workers=workers, seed=7) for workers in (1, 2)]
+        self.assertEqual(trees[0].nodes, trees[1].nodes)
+        self.assertEqual(trees[0].multistart["finished"], 4)
+        self.assertLessEqual((trees[0].max_depth, len(trees[0].nodes)), (single.max_depth, len(single.nodes)))
+        self.assertEqual(trees[0].leaves, set(leaves))
+        
+        with self.assertRaises(TimeoutError):
+            genetic.build_multistart(ROOT, leaves, starts=2, workers=1, time_budget=-1)
+        with self.assertRaises(ValueError):
+            TreeBuilder(ROOT, prune=True, tie_break="last")
+    
+    def test_build_sharded(self):
+        """Тест построения по кластерам со слиянием поддеревьев под корнем"""
+        from sharded import build_sharded, cluster_leaves
+        
+        leaves = [*LEAVES, "abxc", "bxcd", "klm", "abxcdd"]
+        for cluster_by in ("qgram", "length"):
+            clusters = cluster_leaves(ROOT, leaves, 3, cluster_by=cluster_by)
+            self.assertLessEqual(len(clusters), 3)
+            self.assertEqual(sorted(sum(clusters, [])), sorted(leaves))
+            
+            for workers in (1, 2):
+                tree = build_sharded(ROOT, leaves, shards=3, workers=workers, cluster_by=cluster_by)
+                self.assertEqual(tree.leaves, set(leaves))
+                for leaf in leaves:
+                    self.assertIn(leaf, tree.nodes)
+                for node, data in tree.nodes.items():
+                    self.assertLessEqual(data["edge_count"], 3)
+                    self.assertEqual(data["edge_count"], len(data["children"]))
+                    for child in data["children"]:
+                        self.assertEqual(tree.nodes[child["node"]]["parent"], node)
+        
+        # Один кластер - обычное построение
+        self.assertEqual(build_sharded(ROOT, leaves, shards=1).nodes, build_optimal_tree(ROOT, leaves).nodes)
+    
+    def test_remove_and_replace_leaf(self):
+        """Тест удаления и замены листа без перестройки дерева"""
+        from storage import CompactNodeStore, DeltaLabelNodeStore
+        
+        leaves = [*LEAVES, "abxc", "bxcd"]
+        
+        def check(tree):
+            for node, data in tree.nodes.items():
+                self.assertEqual(data["edge_count"], len(data["children"]))
+                for child in data["children"]:
+                    self.assertEqual(tree.nodes[child["node"]]["parent"], node)
+            open_nodes = {(node, data["depth"], data["edge_count"]) for node, data in tree.nodes.items()
+                          if data["edge_count"] < tree.max_edges}
+            self.assertEqual(set(tree.get_available_nodes()), open_nodes)
+            for leaf in tree.leaves:
+                self.assertIn(leaf, tree.nodes)
+        
+        for node_store in (None, CompactNodeStore, DeltaLabelNodeStore):
+            tree = build_optimal_tree(ROOT, leaves, node_store=node_store)
+            count = len(tree.nodes)
+            removed = tree.remove_leaf("lbxcdp")
+            self.assertGreater(removed, 0)
+            self.assertEqual(len(tree.nodes), count - removed)
+            self.assertNotIn("lbxcdp", tree.leaves)
+            self.assertNotIn("lbxcdp", tree.nodes)
+            check(tree)
+            
+            tree.replace_leaf("dc", "dcx")
+            self.assertIn("dcx", tree.leaves)
+            self.assertNotIn("dc", tree.leaves)
+            check(tree)
+            
+            for leaf in list(tree.leaves):
+                tree.remove_leaf(leaf)
+            self.assertEqual(list(tree.nodes), [ROOT])
+            self.assertEqual(tree.max_depth, 0)
+            check(tree)
+            
+            with self.assertRaises(ValueError):
+                tree.remove_leaf("abl")
+        
+        # Снова открытые узлы занимают прежнее место: после снимка дерево достраивается так же
+        import os
+        import tempfile
+        from snapshot import load_tree, save_tree
+        leaves = ["bbba", "abba", "aabbaa", "bbbaab", "bbbba", "bbbaaa", "bbbbaa", "bbaa", "abaa", "abbaa",
+                  "bbaaa", "babaa", "abbbaa", "bba"]
+        tree = build_optimal_tree("bbbaa", leaves[:10])
+        for leaf in leaves[:3]:
+            tree.remove_leaf(leaf)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tree.snap")
+            save_tree(tree, path)
+            loaded = load_tree(path)
+        self.assertEqual([node for node, _, _ in loaded.get_available_nodes()],
+                         [node for node, _, _ in tree.get_available_nodes()])
+        self.assertEqual(loaded._clones, tree._clones)
+        for leaf in leaves[10:]:
+            tree.attach_leaf(leaf)
+            loaded.attach_leaf(leaf)
+        self.assertEqual(loaded.nodes, tree.nodes)
+    
+    def test_ancestor_index(self):
+        """Тест индекса предков: LCA, расстояния, k-й предок и операции от корня"""
+        from ancestry import AncestorIndex
+        
+        tree = EvolutionTree("abc")
+        tree.add_path_to_tree([("add", "d"), ("add", "e")], "abcde", "abc")
+        tree.add_path_to_tree([("add", "x")], "abcdx", "abcd")
+        tree.add_path_to_tree([("del", "c")], "ab", "abc")
+        index = AncestorIndex(tree)
+        
+        self.assertEqual(len(index), len(tree.nodes))
+        self.assertEqual(index.lca("abcde", "abcdx"), "abcd")
+        self.assertEqual(index.lca("abcde", "ab"), "abc")
+        self.assertEqual(index.lca("abcd", "abcde"), "abcd")
+        self.assertEqual(index.distance("abcde", "ab"), 3)
+        self.assertTrue(index.is_ancestor("abc", "abcdx"))
+        self.assertFalse(index.is_ancestor("ab", "abcdx"))
+        self.assertEqual(index.ancestor("abcde", 2), "abc")
+        self.assertIsNone(index.ancestor("abcde", 3))
+        self.assertEqual(index.path_ops("abcdx"), [("add", "d"), ("add", "x")])
+        
+        pairs = [("abcde", "abcdx"), ("ab", "abcde"), ("abc", "abc")]
+        self.assertEqual(index.lca_many(pairs), ["abcd", "abc", "abc"])
+        self.assertEqual(list(index.distances(pairs)), [2, 3, 0])
+    
+    def test_tree_service(self):
+        """Тест asyncio-сервиса: пакетное добавление листьев и запросы через сокет"""
+        import asyncio
+        import json
+        from service import TreeService, serve
+        
+        
+        async def run():
+            service = TreeService(batch_delay=0.01)
+            service.create("t", ROOT)
+            results = await asyncio.gather(*(service.attach("t", leaf) for leaf in LEAVES))
+            self.assertEqual(service.batches, 1)
+            
+            builder = TreeBuilder(ROOT)
+            expected = [builder.attach(leaf) for leaf in LEAVES]
+            self.assertEqual(results, expected)
+            self.assertEqual(service.builders["t"].tree.nodes, builder.tree.nodes)
+
+            # info ждет, пока дерево изменяет другая операция
+            async with service._locks["t"]:
+                info = asyncio.ensure_future(service.info("t"))
+                await asyncio.sleep(0)
+                self.assertFalse(info.done())
+            self.assertEqual((await info)["leaves"], len(LEAVES))
+
+            server = await serve(service, port=0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for request in ({"op": "attach", "tree": "t", "leaf": "abxcdd", "id": 1},
+                            {"op": "info", "tree": "nope"}, [1, 2],
+                            {"op": "attach", "tree": "t", "leaf": ["x"], "id": 2}):
+                writer.write(json.dumps(request).encode() + b"\n")
+            writer.write_eof()
+            # Сервер отвечает на все запросы и закрывает соединение
+            responses = [json.loads(line) async for line in reader]
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return responses
+        
+        responses = asyncio.run(run())
+        attach = next(response for response in responses if response.get("id") == 1)
+        self.assertTrue(attach["ok"])
+        self.assertFalse(attach["exists"])
+        self.assertTrue(attach["path"])
+        self.assertGreater(attach["depth"], 0)
+        self.assertIn({"ok": False, "error": "Дерево 'nope' не найдено"}, responses)
+        self.assertIn({"ok": False, "error": "Запрос должен быть JSON-объектом"}, responses)
+        self.assertIn({"ok": False, "error": "Поле 'leaf' должно быть строкой", "id": 2}, responses)
+    
+    def test_loader(self):
+        """Тест чтения листьев из файлов: строки, gzip, FASTA, удаление повторов"""
+        import gzip
+        import os
+        import tempfile
+        from loader import iter_leaves, load_root_and_leaves
+        
+        with tempfile.TemporaryDirectory() as directory:
+            lines_path = os.path.join(directory, "leaves.txt")
+            with open(lines_path, "w") as f:
+                f.write("abxcd\ncbxd\r\n\nbxd\ncbxd")
+            self.assertEqual(list(iter_leaves(lines_path)), ["abxcd", "cbxd", "bxd", "cbxd"])
+            self.assertEqual(list(iter_leaves(lines_path, dedupe=True)), ["abxcd", "cbxd", "bxd"])
+            
+            gzip_path = os.path.join(directory, "leaves.txt.gz")
+            with gzip.open(gzip_path, "wt") as f:
+                f.write("abxcd\ncbxd\n")
+            self.assertEqual(list(iter_leaves(gzip_path)), ["abxcd", "cbxd"])
+            
+            fasta_path = os.path.join(directory, "leaves.fa")
+            with open(fasta_path, "w") as f:
+                f.write(">root\nabx\ncd\n>leaf 1\ncbxd\n")
+            root, leaves = load_root_and_leaves(fasta_path)
+            self.assertEqual(root, "abxcd")
+            tree = build_optimal_tree(root, leaves)
+            self.assertEqual(tree.leaves, {"cbxd"})
+            
+            empty_path = os.path.join(directory, "empty.txt")
+            open(empty_path, "w").close()
+            self.assertEqual(list(iter_leaves(empty_path)), [])
+    
+    def test_write_dot(self):
+        """Тест потоковой записи DOT и отбора узлов для отрисовки"""
+        import io
+        
+        tree = EvolutionTree("abc")
+        tree.add_path_to_tree([("add", "d"), ("add", "e"), ("sub", "a→x")], "xbcde", "abc")
+        tree.add_path_to_tree([("del", "c")], "ab", "abc")
+        tree.leaves.update({"xbcde", "ab"})
+        
+        out = io.StringIO()
+        self.assertEqual(tree.write_dot(out), len(tree.nodes))
+        text = out.getvalue()
+        self.assertTrue(text.startswith("digraph {"))
+        self.assertIn('"abcd" -> "abcde" [label="e" color="green" fontcolor="green"]', text)
+        
+        self.assertEqual(tree.write_dot(io.StringIO(), max_depth=1), 3)
+        self.assertEqual(tree.write_dot(io.StringIO(), subtree="abcd"), 3)
+        self.assertEqual(tree.write_dot(io.StringIO(), leaves=["ab"]), 2)
+        
+        # Цепочка abc -> abcd -> abcde -> xbcde сворачивается в одно ребро
+        out = io.StringIO()
+        self.assertEqual(tree.write_dot(out, collapse_chains=True), 3)
+        self.assertIn('"abc" -> "xbcde" [label="d\\ne\\na→x" color="black" fontcolor="black"]', out.getvalue())
+        
+        with self.assertRaises(ValueError):
+            tree.write_dot(io.StringIO(), subtree="zzz")
+    
+    def test_benchmark(self):
+        """Тест генератора синтетических наборов и сравнения замеров"""
+        from benchmark import compare, generate_dataset, run_benchmarks
+        
+        root, leaves = generate_dataset(50, length=10, alphabet_size=3, distance=2, seed=1)
+        self.assertEqual((root, leaves), generate_dataset(50, length=10, alphabet_size=3, distance=2, seed=1))
+        self.assertEqual(len(set(leaves)), len(leaves))
+        self.assertNotIn(root, leaves)
+        self.assertTrue(set("".join(leaves)) <= set("abc"))
+        
+        report = run_benchmarks(scales=(10,), length=8, build_limit=None)
+        names = {entry["name"] for entry in report["results"]}
+        self.assertEqual(names, {"find_evolution_path", "add_path_to_tree", "build_optimal_tree", "get_available_nodes"})
+        
+        slower = {"meta": report["meta"],
+                  "results": [dict(entry, seconds=entry["seconds"] * 2 + 1) for entry in report["results"]]}
+        self.assertEqual(len(compare(slower, report)), len(report["results"]))
+        self.assertEqual(compare(report, slower), [])
+        
+        # Замеры с другими параметрами построения не сравниваются
+        pruned = run_benchmarks(scales=(10,), length=8, build_limit=None, prune=True)
+        with self.assertRaises(ValueError):
+            compare(pruned, report)
+
+        # Явно заданная стратегия по умолчанию не мешает сравнению
+        greedy = run_benchmarks(scales=(10,), length=8, build_limit=None, strategy="greedy")
+        self.assertEqual(greedy["meta"]["options"], report["meta"]["options"])
+        compare(greedy, report)
+
+        # Для наборов больше build_limit открытые узлы замеряются на дереве из add_path_to_tree
+        large = run_benchmarks(scales=(10,), length=8, build_limit=5)
+        available = [entry for entry in large["results"] if entry["name"] == "get_available_nodes"]
+        self.assertEqual([entry["tree"] for entry in available], ["add_path_to_tree"])
+        self.assertNotIn("build_optimal_tree", {entry["name"] for entry in large["results"]})
+        # и не сравниваются с замерами на дереве из build_optimal_tree
+        slower = {"meta": large["meta"], "results": [dict(entry, seconds=entry["seconds"] * 2 + 1) for entry in available]}
+        self.assertEqual(compare(slower, report), [])
+
+        # Замер пути идет выбранной стратегией
+        with mock.patch("strategies.BitParallelPathStrategy.path", autospec=True) as path:
+            run_benchmarks(scales=(10,), length=8, build_limit=0, strategy="bitparallel")
+        self.assertTrue(path.called)
+    
+    def test_render_backends(self):
+        """Тест реестра способов отрисовки, экспорта в JSON и импорта ядра без graphviz"""
+        import io
+        import json
+        import os
+        import subprocess
+        import sys
+        import render
+        
+        tree = build_optimal_tree("abxcd", ["cbxd", "bxd", "dc"])
+        out = io.StringIO()
+        self.assertEqual(tree.render("json", out), len(tree.nodes))
+        data = json.loads(out.getvalue())
+        self.assertEqual(data["root"], "abxcd")
+        self.assertEqual({node["node"] for node in data["nodes"]}, set(tree.nodes))
+        self.assertEqual({node["node"] for node in data["nodes"] if node["leaf"]}, tree.leaves)
+        for node in data["nodes"]:
+            self.assertEqual(node["parent"], tree.nodes[node["node"]]["parent"])
+        
+        # Реестр общий для всего процесса: после теста он восстанавливается
+        with mock.patch.dict(render.BACKENDS):
+            render.register_backend("count", lambda tree: len(tree.nodes))
+            self.assertEqual(tree.render("count"), len(tree.nodes))
+        self.assertNotIn("count", render.BACKENDS)
+        with self.assertRaises(ValueError):
+            tree.render("nope")
+        
+        code = "import sys, genetic; print('graphviz' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), "False")
+    
     def test_visualize(self):
         """Тест визуализации (проверяем, что функция не падает)"""
         self.tree.add_node("root", "child", ("add", "x"), 1)
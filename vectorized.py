@@ -0,0 +1,97 @@
+import numpy as np
+
+
+def encode_names(names):
+    """
+    Закодировать строки в матрицу кодов символов uint32, дополненную нулями.
+    Возвращает (матрица, массив длин строк).
+    """
+    lengths = np.fromiter((len(name) for name in names), dtype=np.int64, count=len(names))
+    width = int(lengths.max()) if len(names) else 0
+    codes = np.zeros((len(names), width), dtype=np.uint32)
+    for row, name in enumerate(names):
+        if name:
+            codes[row, :len(name)] = np.frombuffer(name.encode("utf-32-le"), dtype=np.uint32)
+    return codes, lengths
+
+
+def batch_path_lengths(leaf, names):
+    """
+    Длины путей evolution_path_length(name, leaf) для всех names сразу.
+
+    Жадный поиск общих символов идет по позициям i в именах одновременно
+    для всех строк: на каждом шаге для каждой строки ищется первое
+    совпадение с листом в ее окне поиска, а длина пути накапливается
+    так же, как в evolution_path_length. Возвращает массив int64.
+    """
+    leaf = str(leaf)
+    names = [str(name) for name in names]
+    codes, n1 = encode_names(names)
+    rows = len(names)
+    n2 = len(leaf)
+
+    length = np.zeros(rows, dtype=np.int64)
+    if rows == 0:
+        return length
+    if n2 == 0:
+        # Путь до пустой строки - одно групповое удаление
+        return (n1 > 0).astype(np.int64)
+
+    leaf_codes = np.frombuffer(leaf.encode("utf-32-le"), dtype=np.uint32)
+    positions = np.arange(n2)
+    after_del = np.zeros(rows, dtype=bool)
+    last_w1 = np.full(rows, -1, dtype=np.int64)
+    last_w2 = np.full(rows, -1, dtype=np.int64)
+
+    for i in range(codes.shape[1]):
+        active = i < n1
+        started = last_w2 != -1
+        low = np.where(started, last_w2 + 1, 0)
+        high = np.where(started, np.minimum(last_w2 + i - last_w1 + 1, n2), min(i + 1, n2))
+
+        window = (positions >= low[:, None]) & (positions < high[:, None])
+        matches = (codes[:, i, None] == leaf_codes[None, :]) & window & active[:, None]
+        found = matches.any(axis=1)
+        if not found.any():
+            continue
+        j = matches.argmax(axis=1)
+
+        # Между общими символами: сначала замены, затем удаление лишних символов
+        gap_w2 = np.where(found, j - last_w2 - 1, 0)
+        gap_w1 = np.where(found, i - last_w1 - 1, 0)
+        length += gap_w2
+        after_del &= ~(gap_w2 > 0)
+        deletes = found & (gap_w1 > gap_w2)
+        length += deletes & ~after_del
+        after_del |= deletes
+        last_w1 = np.where(found, i, last_w1)
+        last_w2 = np.where(found, j, last_w2)
+
+    # Хвосты после последнего общего символа
+    tail_w2 = n2 - last_w2 - 1
+    tail_w1 = n1 - last_w1 - 1
+    subs = np.minimum(tail_w1, tail_w2)
+    length += subs
+    after_del &= ~(subs > 0)
+    length += tail_w2 > tail_w1
+    length += (tail_w1 > tail_w2) & ~after_del
+    return length
+
+
+def select_candidate(tree, leaf):
+    """
+    Выбор узла для листа с векторной оценкой всех открытых узлов.
+    Ключ (глубина + длина пути, ребра, позиция узла) совпадает с полным перебором.
+    """
+    available_nodes = tree.get_available_nodes()
+    names = [tree.nodes.name(node) for node, _, _ in available_nodes]
+    depths = np.fromiter((depth for _, depth, _ in available_nodes), dtype=np.int64, count=len(available_nodes))
+    edges = np.fromiter((edge_count for _, _, edge_count in available_nodes), dtype=np.int64, count=len(available_nodes))
+
+    if tree.stats is not None:
+        tree.stats.counters["scored"] += len(names)
+    depth_increase = depths + batch_path_lengths(leaf, names)
+    # lexsort сортирует по последнему ключу, порядок при равенстве сохраняется
+    best = np.lexsort((edges, depth_increase))[0]
+    best_node = available_nodes[best][0]
+    return best_node, tree.find_evolution_path(tree.nodes.name(best_node), leaf)